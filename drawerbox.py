@@ -26,26 +26,41 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 from enum import Flag
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import heapq
+import json
 import math
+import sys
+import time
+from array import array
 #from numbers import Real
 #from operator import pos
 import os.path
 #from typing import List
 #from more_itertools import last
 
-from numpy import False_
+import numpy as np
 import inkex
 import simplepath
 import simplestyle
-import simpletransform
 import re
 from lxml import etree
 from inkex import paths
 from inkex import bezier
 from th_inkscape_path import *
+#   Only used to report the peak memory, not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
 
 DEFAULT_WIDTH = 100
 DEFAULT_HEIGHT = 100
+#   Coordinates closer than this are considered as aligned
+DEFAULT_TOLERANCE = 0.05
 
 CONTACT_LEFT = 1
 CONTACT_RIGHT = 2
@@ -53,39 +68,363 @@ CONTACT_TOP = 4
 CONTACT_BOTTOM = 8
 NO_END_CONTACT = 0
 
-#Global variables
-burn_factor = 0.1
-height = 50.0
-BoundingBox = [ 100000000, 100000000, -100000000, -1000000000]
-zNotches = 2
-zNotchesSize = 10.0
-thickness =3.0
-hasbottom = False
-BottomHoles = []
-
-def DebugMsg(s):
+#   Style of the generated paths, hairline for laser cutting
+PATH_STYLE = 'fill:none;stroke:#000000;stroke-width:0.1'
+#   Space between two panels, and between two sheets when nesting
+PANEL_SPACING = 3
+SHEET_SPACING = 10
+#   Coordinates closer than this are equal when optimising the cut paths
+EPSILON = 1e-6
+#   Maximum number of 2-opt passes, and number of nearest cuts tried by each move, when ordering the cuts
+MAX_2OPT_PASSES = 50
+CUT_NEIGHBOURS = 8
+#   Number of notch outlines kept by each memoised outline function (see BottomNotchOutline)
+NOTCH_CACHE_SIZE = 4096
+#   Outlines of the bottom : bounding rectangle with one hole per notch, bounding rectangle with the touching
+#   holes merged, or outline of the walls with the touching holes merged (see DrawBottom)
+BOTTOM_OUTLINES = ('rectangle', 'merged', 'footprint')
+#   Largest grid used to compute the wall footprint, the bounding rectangle is used beyond (see WallFootprint)
+MAX_FOOTPRINT_CELLS = 4000000
+
+class BoxContext:
     '''
-    Print a debug message into debug file if debug file is defined
+    Generation context of one box: parameters, walls, bounding box and bottom holes.
+    A new context is used for each layout, so that nothing is shared between two runs.
     '''
-    if fDebug:
-        fDebug.write(s)
+    def __init__(self, thickness, height, burn_factor, hasbottom, tolerance=DEFAULT_TOLERANCE):
+        self.thickness = thickness
+        self.height = height
+        self.burn_factor = burn_factor
+        self.hasbottom = hasbottom
+        self.tolerance = tolerance
+        # Compute the number of notches from the height
+        if ( height < 30.0 ):
+            self.zNotches = 1
+        elif ( height < 70.0 ):
+            self.zNotches = 2
+        elif ( height < 110.0 ):
+            self.zNotches = 3
+        else:
+            self.zNotches = 4
+        self.zNotchesSize = height / ( 2.0*self.zNotches + 1.0 )
+        #   Start of the z notches, from the top on the right side and from the bottom on the left side
+        Rank = np.arange(self.zNotches)
+        #   Tuples, as they are keys of the memoised notch outlines
+        self.zNotchesRight = tuple((self.zNotchesSize + 2*Rank*self.zNotchesSize).tolist())
+        self.zNotchesLeft = tuple((height - self.zNotchesSize - 2*Rank*self.zNotchesSize).tolist())
+        self.BoundingBox = [ 100000000, 100000000, -100000000, -1000000000]
+        self.BottomHoles = []
+        self.HorizontalWalls = []
+        self.VerticalWalls = []
+        #   Rectangles waiting to be added as walls: ids, and x, y, w, h + transform (a, b, c, d, e, f) for each one
+        self.RectIds = []
+        self.RectData = array('d')
+        #   Size of the sheets used to nest the panels, 0 to draw the panels in a single column
+        self.SheetWidth = 0
+        self.SheetHeight = 0
+        #   Paths of a previous run, by wall key (see wall.CacheKey), None when the cache is not used
+        self.PathCache = None
+        #   Draw identical walls once, the other ones are clones of the first one
+        self.Deduplicate = False
+        #   Optimise the cut paths for the laser (see PathBuilder.Optimize)
+        self.OptimizeCuts = False
+        #   Outline of the bottom, one of BOTTOM_OUTLINES
+        self.BottomOutline = 'rectangle'
+        #   Phase times and counters (see RunStats), None when instrumentation is off
+        self.Stats = None
+        #   Paths are written to a file while they are generated (see drawerbox.StreamEffect)
+        self.Streaming = False
+        #   Walls are moved to a WallStore once their contacts are found (see CompactWallLists)
+        self.CompactWalls = False
+        #   In multi-box mode, suffix of the bottom name and top left corner of the panels (see PanelOrigin)
+        self.Name = ''
+        self.PanelOrigin = None
+        self.fDebug = None
+
+    def DebugMsg(self, s, *args):
+        '''
+        Print a debug message into debug file if debug file is defined
+        The message is only formatted (s % args) when debug is on, so callers should pass the values as args
+        '''
+        if self.fDebug:
+            if args:
+                s = s % args
+            self.fDebug.write(s)
+
+    def LoadPathCache(self, layer):
+        '''
+        Fill the path cache with the paths generated by a previous run in layer
+        Each cached path is (d, bounding box), d is in path coordinates
+        '''
+        self.PathCache = {}
+        for node in layer.iter(inkex.addNS('path', 'svg')):
+            Key = node.get('data-drawerbox-key')
+            Box = node.get('data-drawerbox-bbox')
+            if Key and Box:
+                self.PathCache[Key] = (node.get('d'), tuple(float(v) for v in Box.split()))
+
+    def OpenDebugFile(self):
+        try:
+            self.fDebug = open( 'DebugDrawerBox.txt', 'w')
+        except IOError:
+            pass
+        self.DebugMsg("Start processing\n")
 
-def OpenDebugFile():
-    global fDebug
+    def CloseDebugFile(self):
+        if self.fDebug:
+            self.fDebug.close()
+            self.fDebug = None
+
+    #   Add a wall (rectangle)
+    #   x, y are the coordinates of the top left point, w and h are the width and length of the wall
+    #   If w > h the wall is horizontal, otherwise it is vertical.
+    #   Build a list of horizontal an vertical walls, the lists are sorted once all walls are added
+    #   Coordinates are snapped and the bounding box computed once all walls are added (see SnapWalls)
+    def AddWall(self, id, x, y, w, h):
+        Wall = wall(id, x, y, w, h)
+        if ( w > h ):
+            self.HorizontalWalls.append(Wall)
+        else:
+            self.VerticalWalls.append(Wall)
+
+    #   Queue a rectangle, matrix is the transform from the rectangle coordinates to the document.
+    #   Queued rectangles are added all at once by AddRectangles
+    def QueueRectangle(self, id, x, y, w, h, matrix):
+        self.RectIds.append(id)
+        self.RectData.extend((x, y, w, h, matrix.a, matrix.b, matrix.c, matrix.d, matrix.e, matrix.f))
+
+    #   Add all queued rectangles as walls, with array operations
+    #   Rectangles are mapped to the document and classified as horizontal (w > h) or vertical.
+    #   Coordinates are not rounded here, they are snapped and rounded to 0.1 by SnapWalls.
+    #   Only transforms which keep the rectangle sides horizontal and vertical are handled
+    #   (translate, scale, rotation by a multiple of 90°, ...)
+    #   The walls are appended to the lists already sorted.
+    def AddRectangles(self):
+        if len(self.RectIds) == 0:
+            return
+        Ids = self.RectIds
+        x, y, w, h, a, b, c, d, e, f = np.frombuffer(self.RectData, dtype=float).reshape(-1, 10).T
+        self.RectIds = []
+        self.RectData = array('d')
+
+        Orthogonal = ((np.abs(b) < 1e-9) & (np.abs(c) < 1e-9)) | ((np.abs(a) < 1e-9) & (np.abs(d) < 1e-9))
+        for i in np.flatnonzero(~Orthogonal).tolist():
+            inkex.errormsg( 'Unhandled transformation :' + str(inkex.Transform((a[i], b[i], c[i], d[i], e[i], f[i]))) )
+        #   Map 2 opposite corners to the document coordinates
+        x1 = a*x + c*y + e
+        y1 = b*x + d*y + f
+        x2 = a*(x+w) + c*(y+h) + e
+        y2 = b*(x+w) + d*(y+h) + f
+        Keep = np.flatnonzero(Orthogonal)
+        xrect = np.minimum(x1, x2)[Keep]
+        yrect = np.minimum(y1, y2)[Keep]
+        wrect = np.abs(x2 - x1)[Keep]
+        hrect = np.abs(y2 - y1)[Keep]
+
+        #   Horizontal walls sorted by y then x, vertical walls by x then y
+        Horizontal = wrect > hrect
+        HIndex = np.flatnonzero(Horizontal)
+        VIndex = np.flatnonzero(~Horizontal)
+        HIndex = HIndex[np.lexsort((xrect[HIndex], yrect[HIndex]))]
+        VIndex = VIndex[np.lexsort((yrect[VIndex], xrect[VIndex]))]
+        Rects = list(zip(Keep[HIndex].tolist(), xrect[HIndex].tolist(), yrect[HIndex].tolist(), wrect[HIndex].tolist(), hrect[HIndex].tolist()))
+        self.HorizontalWalls.extend([wall(Ids[i], xr, yr, wr, hr) for i, xr, yr, wr, hr in Rects])
+        Rects = list(zip(Keep[VIndex].tolist(), xrect[VIndex].tolist(), yrect[VIndex].tolist(), wrect[VIndex].tolist(), hrect[VIndex].tolist()))
+        self.VerticalWalls.extend([wall(Ids[i], xr, yr, wr, hr) for i, xr, yr, wr, hr in Rects])
+
+
+#   Parametric grid layouts : the walls of a box of Rows x Columns cells are computed from its size,
+#   and added to the context without any rectangle to draw or to parse (see GridWalls and AddGridWalls)
+
+#   Split Length in Count parts proportional to Weights, in equal parts when Weights is empty
+def SplitLength(Length, Count, Weights, Name):
+    if not Weights:
+        Weights = [1.0] * Count
+    if len(Weights) != Count:
+        raise ValueError('%d %s expected, %d given' % (Count, Name, len(Weights)))
+    if min(Weights) <= 0:
+        raise ValueError('The ' + Name + ' should be positive')
+    Total = float(sum(Weights))
+    return [Length * Weight / Total for Weight in Weights]
+
+#   Position of each wall line, from the start and the sizes of the cells between the lines
+def WallPositions(Start, Sizes, thickness):
+    Positions = [Start]
+    for Size in Sizes:
+        Positions.append(Positions[-1] + thickness + Size)
+    return Positions
+
+#   Walls of a grid of Rows x Columns cells, whose outer size (walls included) is Width x Height,
+#   with its top left corner at (x, y).
+#   ColumnWidths and RowHeights are the relative sizes of the columns and rows, equal when empty.
+#   Merges is a list of (Row, Column, nRows, nColumns) : the cells from (Row, Column), 0 based, over nRows rows
+#   and nColumns columns are merged into one compartment, the walls between them are removed.
+#   Walls are cut at the nodes of the grid by the junction rule : the H wall covers the node when it goes
+#   through it or at a corner, the V wall covers it when it goes through it, and both do when they cross.
+#   Return the walls, each one (id, x, y, w, h) as for BoxContext.AddWall
+#   Raise ValueError if the grid could not be built, for example when two merges overlap
+def GridWalls(Width, Height, Rows, Columns, thickness, ColumnWidths=None, RowHeights=None, Merges=(), x=0.0, y=0.0):
+    if Rows < 1 or Columns < 1:
+        raise ValueError('The grid should have at least one row and one column')
+    Widths = SplitLength(Width - (Columns + 1) * thickness, Columns, ColumnWidths, 'column widths')
+    Heights = SplitLength(Height - (Rows + 1) * thickness, Rows, RowHeights, 'row heights')
+    if min(Widths + Heights) <= thickness:
+        raise ValueError('The grid is too small, each cell should be larger than the material thickness')
+    X = WallPositions(x, Widths, thickness)
+    Y = WallPositions(y, Heights, thickness)
+
+    #   Compartment of each cell, merged cells share the same compartment, each merge is a rectangular compartment
+    Compartment = np.arange(Rows * Columns).reshape(Rows, Columns)
+    Merged = np.zeros((Rows, Columns), dtype=bool)
+    for Row, Column, nRows, nColumns in Merges:
+        if Row < 0 or Column < 0 or nRows < 1 or nColumns < 1 or Row + nRows > Rows or Column + nColumns > Columns:
+            raise ValueError('The merge of %d x %d cells at row %d, column %d is outside the grid' % (nRows, nColumns, Row + 1, Column + 1))
+        if Merged[Row:Row + nRows, Column:Column + nColumns].any():
+            raise ValueError('The merge of %d x %d cells at row %d, column %d overlaps another merge' % (nRows, nColumns, Row + 1, Column + 1))
+        Merged[Row:Row + nRows, Column:Column + nColumns] = True
+        Compartment[Row:Row + nRows, Column:Column + nColumns] = Compartment[Row, Column]
+
+    #   H[i, j] : wall side from node (i, j) to node (i, j+1), V[i, j] : wall side from node (i, j) to node (i+1, j)
+    H = np.ones((Rows + 1, Columns), dtype=bool)
+    H[1:-1] = Compartment[1:] != Compartment[:-1]
+    V = np.ones((Rows, Columns + 1), dtype=bool)
+    V[:, 1:-1] = Compartment[:, 1:] != Compartment[:, :-1]
+    #   Wall sides around each node
+    Left = np.zeros((Rows + 1, Columns + 1), dtype=bool)
+    Right = np.zeros_like(Left)
+    Up = np.zeros_like(Left)
+    Down = np.zeros_like(Left)
+    Left[:, 1:] = H
+    Right[:, :-1] = H
+    Up[1:] = V
+    Down[:-1] = V
+    HCovers = ((Left & Right) | ((Left | Right) & (Up != Down))).tolist()
+    VCovers = (Up & Down).tolist()
+
+    Walls = []
+    #   Each run of sides along a line is a wall, it starts and ends on the nodes it covers or next to them
+    for i, Sides in enumerate(H.tolist()):
+        j = 0
+        while j < Columns:
+            if not Sides[j]:
+                j += 1
+                continue
+            k = j
+            while k < Columns and Sides[k]:
+                k += 1
+            x0 = X[j] if HCovers[i][j] else X[j] + thickness
+            x1 = X[k] + thickness if HCovers[i][k] else X[k]
+            Walls.append(('grid_h%d_%d' % (i, j), x0, Y[i], x1 - x0, thickness))
+            j = k
+    for j, Sides in enumerate(V.T.tolist()):
+        i = 0
+        while i < Rows:
+            if not Sides[i]:
+                i += 1
+                continue
+            k = i
+            while k < Rows and Sides[k]:
+                k += 1
+            y0 = Y[i] if VCovers[i][j] else Y[i] + thickness
+            y1 = Y[k] + thickness if VCovers[k][j] else Y[k]
+            Walls.append(('grid_v%d_%d' % (j, i), X[j], y0, thickness, y1 - y0))
+            i = k
+    return Walls
+
+#   Add the walls of a grid (see GridWalls) to the context, with the material thickness of the context
+#   Return the number of walls added
+def AddGridWalls(ctx, Width, Height, Rows, Columns, ColumnWidths=None, RowHeights=None, Merges=(), x=0.0, y=0.0):
+    Walls = GridWalls(Width, Height, Rows, Columns, ctx.thickness, ColumnWidths, RowHeights, Merges, x, y)
+    for Wall in Walls:
+        ctx.AddWall(*Wall)
+    ctx.DebugMsg("Grid %s x %s, %d rows, %d columns, %d merges : %d walls\n", Width, Height, Rows, Columns, len(Merges), len(Walls))
+    return len(Walls)
+
+#   Parse relative sizes, as "1,2,1" (empty for equal sizes)
+def ParseGridSizes(Text):
     try:
-        fDebug = open( 'DebugDrawerBox.txt', 'w')
-    except IOError:
-        pass
-    DebugMsg("Start processing\n")
+        return [float(Size) for Size in Text.replace(';', ',').split(',') if Size.strip()]
+    except ValueError:
+        raise ValueError('Unable to read the sizes "' + Text + '", expected numbers separated by commas')
+
+#   Parse merges, as "row,column,rows,columns" separated by ";" with rows and columns numbered from 1
+#   Return them as tuples for GridWalls, numbered from 0
+def ParseGridMerges(Text):
+    Merges = []
+    for Merge in Text.split(';'):
+        if not Merge.strip():
+            continue
+        try:
+            Row, Column, nRows, nColumns = (int(Value) for Value in Merge.split(','))
+        except ValueError:
+            raise ValueError('Unable to read the merge "' + Merge.strip() + '", expected row,column,rows,columns')
+        Merges.append((Row - 1, Column - 1, nRows, nColumns))
+    return Merges
 
-def CloseDebugFile():
-    global fDebug
-    if fDebug:
-        fDebug.close()
-        fDebug = None
+
+class RunStats:
+    '''
+    Instrumentation of a run: wall time of each phase, counters and peak memory, reported as one JSON object.
+    Only created when asked for, otherwise BoxContext.Stats is None and nothing is measured.
+    '''
+    def __init__(self):
+        self.Phases = {}
+        self.Counters = {}
+        self.PhaseName = None
+        self.PhaseStart = 0.0
+
+    #   End the current phase and start the phase Name (None to end the current phase only)
+    def Phase(self, Name):
+        Now = time.perf_counter()
+        if self.PhaseName:
+            self.Phases[self.PhaseName] = self.Phases.get(self.PhaseName, 0.0) + Now - self.PhaseStart
+        self.PhaseName = Name
+        self.PhaseStart = Now
+
+    def Count(self, Name, Value):
+        self.Counters[Name] = self.Counters.get(Name, 0) + Value
+
+    #   Count walls, contacts, notches, holes and path commands, once the box is generated
+    #   Panels is None when paths were streamed, they are not counted then
+    def CountBox(self, ctx, Panels):
+        Walls = ctx.HorizontalWalls + ctx.VerticalWalls
+        self.Count('walls', len(Walls))
+        self.Count('contacts', sum(len(w.ContactList) for w in Walls))
+        self.Count('crossings', sum(len(w.CrossList) for w in Walls) // 2)
+        SideNotches = sum((w.Contact & (CONTACT_LEFT | CONTACT_BOTTOM) != 0) + (w.Contact & (CONTACT_RIGHT | CONTACT_TOP) != 0) for w in Walls)
+        self.Count('notches', SideNotches * ctx.zNotches + len(ctx.BottomHoles))
+        self.Count('bottom_holes', len(ctx.BottomHoles))
+        if Panels is None:
+            return
+        self.Count('paths', len(Panels))
+        self.Count('paths_cached', sum(1 for path in Panels if path.CachedData))
+        self.Count('paths_cloned', sum(1 for path in Panels if path.Original))
+        self.Count('path_commands', sum(len(path.Opcodes) for path in Panels))
+
+    def Summary(self):
+        self.Phase(None)
+        Summary = {'phases': {Name: round(Value, 6) for Name, Value in self.Phases.items()},
+                   'total': round(sum(self.Phases.values()), 6),
+                   'counters': self.Counters}
+        if resource:
+            #   ru_maxrss is in kB, except on macOS where it is in bytes
+            PeakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            Summary['peak_memory_kb'] = PeakMemory // 1024 if sys.platform == 'darwin' else PeakMemory
+        return Summary
+
+    #   Write the summary as JSON into FileName, or as a single line on stderr if FileName is empty
+    def Write(self, FileName):
+        Summary = json.dumps(self.Summary())
+        if FileName:
+            with open(FileName, 'w') as f:
+                f.write(Summary + '\n')
+        else:
+            sys.stderr.write('DrawerBox stats ' + Summary + '\n')
 
 
 class Contact:
+    __slots__ = ('direction', 'start', 'end')
+
     def __init__(self, start, end, direction):
         self.direction = direction
         self.start = start
@@ -95,7 +434,315 @@ class Contact:
         s = "Direction: " + str(self.direction) + " start:" + str(self.start) + " end:" + str(self.end) + '\n'
         return s
 
+class WallIndex:
+    '''
+    Index on a list of walls with the same orientation, used to look for end contacts.
+    Walls are grouped by the integer key of their start and end sides (x for vertical walls, y for horizontal walls).
+    Within a group, walls are sorted along the wall axis, so that only walls overlapping a segment are visited.
+    '''
+    def __init__(self, ListWall, vertical):
+        self.vertical = vertical
+        self.StartMap = {}
+        self.EndMap = {}
+        for w in ListWall:
+            if vertical:
+                self.AddToMap(self.StartMap, w.ix0, w.y0, w.y1, w)
+                self.AddToMap(self.EndMap, w.ix1, w.y0, w.y1, w)
+            else:
+                self.AddToMap(self.StartMap, w.iy0, w.x0, w.x1, w)
+                self.AddToMap(self.EndMap, w.iy1, w.x0, w.x1, w)
+        for Map in (self.StartMap, self.EndMap):
+            for key in Map:
+                Bucket = Map[key]
+                Bucket.sort(key=lambda elt: elt[0])
+                #   Each entry is (sorted starts, walls, max extent of the walls)
+                Map[key] = ([elt[0] for elt in Bucket], [elt[2] for elt in Bucket], max(elt[1] - elt[0] for elt in Bucket))
+
+    def AddToMap(self, Map, key, start, end, w):
+        if key in Map:
+            Map[key].append((start, end, w))
+        else:
+            Map[key] = [(start, end, w)]
+
+    #   Return the walls whose side has the given key and which overlap the segment ]s0, s1[
+    def Candidates(self, Map, key, s0, s1):
+        Bucket = Map.get(key)
+        if Bucket is None:
+            return []
+        Starts, Walls, MaxExtent = Bucket
+        #   A wall could only overlap if it starts after s0 - MaxExtent and before s1
+        first = bisect.bisect_left(Starts, s0 - MaxExtent)
+        last = bisect.bisect_left(Starts, s1)
+        return Walls[first:last]
+
+class PathBuilder:
+    '''
+    Path accumulator with the same drawing methods as th_inkscape_path.
+    Commands are stored in an opcode array and their coordinates in an array of doubles,
+    the d attribute is only built when the path is generated, in a single join.
+    Coordinates are relative to the path origin, PositionInPage is subtracted when generating the path.
+    The path is built first and placed later (see Place), so that the layout could use its bounding box,
+    then written to an output sink (see TreeSink and StreamSink).
+    '''
+    MOVE = 0
+    LINE = 1
+    HREL = 2
+    VREL = 3
+    CLOSE = 4
+    __slots__ = ('PositionInPage', 'Sheet', 'name', 'Opcodes', 'Coords', 'Key', 'CachedData', 'CachedBox', 'Original', 'Quantity')
+
+    def __init__(self, name):
+        self.PositionInPage = [0, 0]
+        #   Sheet of the path, when panels are nested on sheets
+        self.Sheet = 0
+        self.name = name
+        self.Opcodes = array('B')
+        self.Coords = array('d')
+        #   Cache key of the path, and d attribute and bounding box when taken from the cache
+        self.Key = None
+        self.CachedData = None
+        self.CachedBox = None
+        #   Path with the same outline, when this path is generated as a clone of it,
+        #   and number of walls with this outline (the path and its clones)
+        self.Original = None
+        self.Quantity = 1
+
+    def MoveTo(self, x, y):
+        self.Opcodes.append(PathBuilder.MOVE)
+        self.Coords.append(x)
+        self.Coords.append(y)
+
+    def LineTo(self, x, y):
+        self.Opcodes.append(PathBuilder.LINE)
+        self.Coords.append(x)
+        self.Coords.append(y)
+
+    def LineToHRel(self, dx):
+        self.Opcodes.append(PathBuilder.HREL)
+        self.Coords.append(dx)
+        self.Coords.append(0.0)
+
+    def LineToVRel(self, dy):
+        self.Opcodes.append(PathBuilder.VREL)
+        self.Coords.append(0.0)
+        self.Coords.append(dy)
+
+    def Close(self):
+        self.Opcodes.append(PathBuilder.CLOSE)
+        self.Coords.append(0.0)
+        self.Coords.append(0.0)
+
+    #   Return the commands of the path as a block (opcodes, coordinates, indices of the absolute x coordinates),
+    #   a block is drawn once and appended to many paths by AppendBlock
+    def Block(self):
+        XIndex = [2*i for i, op in enumerate(self.Opcodes) if op == PathBuilder.MOVE or op == PathBuilder.LINE]
+        return (self.Opcodes, self.Coords, XIndex)
+
+    #   Append the commands of Block, moved by dx along x. Only absolute x coordinates are moved
+    def AppendBlock(self, Block, dx):
+        Opcodes, Coords, XIndex = Block
+        Base = len(self.Coords)
+        self.Opcodes.extend(Opcodes)
+        self.Coords.extend(Coords)
+        if dx:
+            for i in XIndex:
+                self.Coords[Base + i] += dx
+
+    #   Set the position of the path, PositionInPage is subtracted from the path coordinates
+    def Place(self, PositionInPage):
+        self.PositionInPage = PositionInPage
+
+    #   Return the bounding box (xmin, ymin, xmax, ymax) of the path, in path coordinates
+    def BoundingBox(self):
+        if self.Original:
+            return self.Original.BoundingBox()
+        if self.CachedBox:
+            return self.CachedBox
+        Coords = self.Coords
+        x = y = 0.0
+        xStart = yStart = 0.0
+        xmin = ymin = float('inf')
+        xmax = ymax = float('-inf')
+        for i, op in enumerate(self.Opcodes):
+            if op == PathBuilder.HREL:
+                x += Coords[2*i]
+            elif op == PathBuilder.VREL:
+                y += Coords[2*i+1]
+            elif op == PathBuilder.CLOSE:
+                x, y = xStart, yStart
+            else:
+                x = Coords[2*i]
+                y = Coords[2*i+1]
+                if op == PathBuilder.MOVE:
+                    xStart, yStart = x, y
+            if x < xmin:
+                xmin = x
+            if x > xmax:
+                xmax = x
+            if y < ymin:
+                ymin = y
+            if y > ymax:
+                ymax = y
+        return (xmin, ymin, xmax, ymax)
+
+    #   Return the subpaths, each one as a list of points, with the start point repeated at the end if closed
+    def Subpaths(self):
+        Coords = self.Coords
+        Subpaths = []
+        Points = None
+        x = y = 0.0
+        for i, op in enumerate(self.Opcodes):
+            if op == PathBuilder.MOVE:
+                x = Coords[2*i]
+                y = Coords[2*i+1]
+                Points = [(x, y)]
+                Subpaths.append(Points)
+                continue
+            if op == PathBuilder.HREL:
+                x += Coords[2*i]
+            elif op == PathBuilder.VREL:
+                y += Coords[2*i+1]
+            elif op == PathBuilder.CLOSE:
+                x, y = Points[0]
+            else:
+                x = Coords[2*i]
+                y = Coords[2*i+1]
+            Points.append((x, y))
+            if op == PathBuilder.CLOSE:
+                #   Drawing could go on from the start point, without a new MoveTo
+                Points = [(x, y)]
+                Subpaths.append(Points)
+        return [Points for Points in Subpaths if len(Points) > 1]
+
+    #   Optimise the path for laser cutting
+    #   Collinear and null segments are merged, then the inner subpaths (holes) are cut first,
+    #   in an order which reduces the travel between them (see PlanCutOrder), and the outer contour is cut last,
+    #   so that the piece does not move before its holes are cut.
+    #   The outer contour is the subpath with the largest bounding box.
+    def Optimize(self):
+        Subpaths = [MergeSegments(Points) for Points in self.Subpaths()]
+        Areas = [(max(p[0] for p in Points) - min(p[0] for p in Points)) * (max(p[1] for p in Points) - min(p[1] for p in Points))
+                 for Points in Subpaths]
+        Outer = Areas.index(max(Areas))
+        Inner = Subpaths[:Outer] + Subpaths[Outer+1:]
+        Order = PlanCutOrder(Subpaths[Outer][0], [Points[0] for Points in Inner])
+        self.Opcodes = array('B')
+        self.Coords = array('d')
+        for Points in [Inner[i] for i in Order] + [Subpaths[Outer]]:
+            self.AddPolyline(Points)
+
+    #   Add a subpath, horizontal and vertical segments are relative, and a closed subpath ends with Close
+    #   Relative moves are differences of rounded coordinates, so that rounding errors do not add up along the path
+    def AddPolyline(self, Points):
+        Closed = len(Points) > 2 and SamePoint(Points[0], Points[-1])
+        if Closed:
+            Points = Points[:-1]
+        x, y = Points[0]
+        self.MoveTo(x, y)
+        for xNext, yNext in Points[1:]:
+            if abs(yNext - y) < EPSILON:
+                self.LineToHRel(round(xNext, 3) - round(x, 3))
+            elif abs(xNext - x) < EPSILON:
+                self.LineToVRel(round(yNext, 3) - round(y, 3))
+            else:
+                self.LineTo(xNext, yNext)
+            x, y = xNext, yNext
+        if Closed:
+            self.Close()
+
+    #   Build the d attribute, in one pass over the opcodes
+    def PathData(self, Offset=None):
+        xOffset, yOffset = Offset or self.PositionInPage
+        Coords = self.Coords
+        Tokens = []
+        for i, op in enumerate(self.Opcodes):
+            if op == PathBuilder.LINE:
+                Tokens.append('L ' + str(round(Coords[2*i] - xOffset, 3)) + ',' + str(round(Coords[2*i+1] - yOffset, 3)))
+            elif op == PathBuilder.HREL:
+                Tokens.append('h ' + str(round(Coords[2*i], 3)))
+            elif op == PathBuilder.VREL:
+                Tokens.append('v ' + str(round(Coords[2*i+1], 3)))
+            elif op == PathBuilder.MOVE:
+                Tokens.append('M ' + str(round(Coords[2*i] - xOffset, 3)) + ',' + str(round(Coords[2*i+1] - yOffset, 3)))
+            else:
+                Tokens.append('z')
+        return ' '.join(Tokens)
+
+    #   Write the path to sink
+    #   With Translate, d is in path coordinates and the position is given by a transform,
+    #   then the same d could be reused wherever the path is placed (see BoxContext.PathCache)
+    def GenPath(self, sink, Translate=False):
+        if self.Original:
+            #   Clone of the original path, moved from the position of the original
+            dx = self.Original.PositionInPage[0] - self.PositionInPage[0]
+            dy = self.Original.PositionInPage[1] - self.PositionInPage[1]
+            use_attribs = {'id': sink.IdPrefix + self.name, inkex.addNS('href', 'xlink'): '#' + sink.IdPrefix + self.Original.name,
+                           'transform': 'translate(' + str(round(dx, 3)) + ',' + str(round(dy, 3)) + ')'}
+            sink.Add(inkex.addNS('use', 'svg'), use_attribs)
+            return
+        if not Translate:
+            line_attribs = {'id': sink.IdPrefix + self.name, 'style': PATH_STYLE, 'd': self.PathData()}
+        else:
+            xOffset, yOffset = self.PositionInPage
+            line_attribs = {'id': sink.IdPrefix + self.name, 'style': PATH_STYLE, 'd': self.CachedData or self.PathData([0, 0]),
+                            'transform': 'translate(' + str(round(-xOffset, 3)) + ',' + str(round(-yOffset, 3)) + ')'}
+            if self.Key:
+                line_attribs['data-drawerbox-key'] = self.Key
+                line_attribs['data-drawerbox-bbox'] = ' '.join(repr(v) for v in self.BoundingBox())
+        #   The original of identical walls is labelled with the number of pieces to cut
+        if self.Quantity > 1:
+            line_attribs[inkex.addNS('label', 'inkscape')] = self.name + ' x' + str(self.Quantity)
+        sink.Add(inkex.addNS('path', 'svg'), line_attribs)
+
+
+class TreeSink:
+    '''
+    Output of the generated elements into the document tree, under group
+    IdPrefix is added to the ids of the generated elements (see drawerbox.LayerIdPrefix)
+    '''
+    def __init__(self, group, IdPrefix=''):
+        self.group = group
+        self.IdPrefix = IdPrefix
+
+    def Add(self, tag, attribs):
+        etree.SubElement(self.group, tag, attribs)
+
+    def OpenGroup(self, attribs):
+        self.group = etree.SubElement(self.group, 'g', attribs)
+
+    def CloseGroup(self):
+        self.group = self.group.getparent()
+
+
+class StreamSink:
+    '''
+    Output of the generated elements straight into a file, with an lxml.etree.xmlfile writer.
+    Each element is written as soon as it is generated, the document tree is not built.
+    IdPrefix is added to the ids of the generated elements (see drawerbox.LayerIdPrefix)
+    '''
+    def __init__(self, xf, IdPrefix=''):
+        self.xf = xf
+        self.IdPrefix = IdPrefix
+        self.Groups = []
+
+    #   xf.element uses the namespaces declared by the enclosing elements, xf.write would declare them again
+    def Add(self, tag, attribs):
+        with self.xf.element(tag, attribs):
+            pass
+
+    def OpenGroup(self, attribs):
+        Group = self.xf.element('g', attribs)
+        Group.__enter__()
+        self.Groups.append(Group)
+
+    def CloseGroup(self):
+        self.Groups.pop().__exit__(None, None, None)
+
 class wall:
+    #   Walls are the most numerous objects, __slots__ avoids a dictionary per wall
+    __slots__ = ('id', 'x0', 'y0', 'w', 'h', 'x1', 'y1', 'ix0', 'iy0', 'ix1', 'iy1',
+                 'Contact', 'ContactList', 'ContactStarts', 'CrossList', 'vertical', 'length')
+
     def __init__(self, id, x, y, w, h):
         self.id = id
         self.x0 = x
@@ -104,8 +751,11 @@ class wall:
         self.h = h
         self.x1 = x + w
         self.y1 = y + h
+        #   Integer keys of the sides (coordinates in tenths), set when the coordinates are snapped
+        self.ix0 = self.iy0 = self.ix1 = self.iy1 = None
         self.Contact = NO_END_CONTACT
         self.ContactList = []
+        self.ContactStarts = []
         self.CrossList = []
         if ( h > w ):
             self.vertical = True
@@ -127,266 +777,125 @@ class wall:
         s += '\n'
         return s
 
-    #   If the wall is vertical, sort by x then y
-    #   If the wall is horizontal, sort by y then x
-    def isLowerThan(self, elt):
-        if self.vertical:
-            if self.x0 < elt.x0:
-                return True
-            if self.x0 == elt.x0 and self.y0 < elt.y0:
-                return True
-            if self.x0 == elt.x0 and self.y0 == elt.y0: 
-                inkex.errormsg("At least 2 walls with same starting point\n")
-            return False
-        else:
-            if self.y0 < elt.y0:
-                return True
-            if self.y0 == elt.y0 and self.x0 < elt.x0:
-                return True
-            if self.y0 == elt.y0 and self.x0 == elt.x0: 
-                inkex.errormsg("At least 2 walls with same starting point\n")
-            return False
-
-    #   Add the wall to the list of walls with the same orientation
-    #   Insert the wall such as the list is sorted.
-    #   If the wall is vertical, sort by x then y
-    #   If the wall is horizontal, sort by y then x
-
-    def add(self, ListWall):
-        pos = 0
-        for wall in ListWall:
-            if self.isLowerThan(wall):
-                break
-            pos += 1
-        ListWall.insert(pos, self)
-
+    #   Insert the contact such as the list is sorted by starting point
+    #   ContactStarts holds the starting points, so the position is found by bisection
     def AddContact(self, contact):
-        pos = 0
         contact.start = round(contact.start, 1)
         contact.end = round(contact.end, 1)
-        for c in self.ContactList:
-            if contact.start <= c.start:
-                break
-            pos += 1
+        pos = bisect.bisect_left(self.ContactStarts, contact.start)
+        self.ContactStarts.insert(pos, contact.start)
         self.ContactList.insert(pos, contact)
 
     #   Look for end contact with a wall in the other list
     #   End contact means contact between the short segments of the wall with a wall in the other list
-    def LookForEndContact(self, ListWall):
+    #   Index is the WallIndex built on the other list, only walls with the matching side key are checked
+    def LookForEndContact(self, Index):
         if self.vertical:
             #Begin with Top of wall
             #In this case, look for connection below H walls
-            for w in ListWall:
-                if self.y0 == w.y1:
-                    if self.x0 > w.x0 and self.x0 < w.x1:
-                        #There is a contact, compute starting and ending point
-                        start_contact = self.x0 - w.x0
-                        end_contact = min(self.x1, w.x1) - w.x0
-                        self.Contact |= CONTACT_TOP
-                        contact = Contact(start_contact, end_contact, CONTACT_TOP)
-                        w.AddContact(contact)
-                    elif self.x1 < w.x1 and self.x1 > w.x0:
-                        #There is a contact, compute starting and ending point
-                        start_contact = max(self.x0, w.x0) - w.x0
-                        end_contact = self.x1 - w.x0
-                        self.Contact |= CONTACT_TOP
-                        contact = Contact(start_contact, end_contact, CONTACT_TOP)
-                        w.AddContact(contact)
+            for w in Index.Candidates(Index.EndMap, self.iy0, self.x0, self.x1):
+                self.SetEndContact(w, self.x0, self.x1, w.x0, w.x1, CONTACT_TOP)
             #Then try Bottom, so look for connection above H walls
-            for w in ListWall:
-                if self.y1 == w.y0:
-                    if self.x0 > w.x0 and self.x0 < w.x1:
-                        #There is a contact, compute starting and ending point
-                        start_contact = self.x0 - w.x0
-                        end_contact = min(self.x1, w.x1) - w.x0
-                        self.Contact |= CONTACT_BOTTOM
-                        contact = Contact(start_contact, end_contact, CONTACT_BOTTOM)
-                        w.AddContact(contact)
-                    elif self.x1 < w.x1 and self.x1 > w.x0:
-                        #There is a contact, compute starting and ending point
-                        start_contact = max(self.x0, w.x0) - w.x0
-                        end_contact = self.x1 - w.x0
-                        self.Contact |= CONTACT_BOTTOM
-                        contact = Contact(start_contact, end_contact, CONTACT_BOTTOM)
-                        w.AddContact(contact)
+            for w in Index.Candidates(Index.StartMap, self.iy1, self.x0, self.x1):
+                self.SetEndContact(w, self.x0, self.x1, w.x0, w.x1, CONTACT_BOTTOM)
         else:
             #Begin with left of wall
             #In this case, look for connection right of V walls
-            for w in ListWall:
-                if self.x0 == w.x1:
-                    if self.y0 > w.y0 and self.y0 < w.y1:
-                        #There is a contact, compute starting and ending point
-                        start_contact = self.y0 - w.y0
-                        end_contact = min(self.y1, w.y1) - w.y0
-                        self.Contact |= CONTACT_LEFT
-                        contact = Contact(start_contact, end_contact, CONTACT_LEFT)
-                        w.AddContact(contact)
-                    elif self.y1 < w.y1 and self.y1 > w.y0:
-                        #There is a contact, compute starting and ending point
-                        start_contact = max(self.y0, w.y0) - w.y0
-                        end_contact = self.y1 - w.y0
-                        self.Contact |= CONTACT_LEFT
-                        contact = Contact(start_contact, end_contact, CONTACT_LEFT)
-                        w.AddContact(contact)
+            for w in Index.Candidates(Index.EndMap, self.ix0, self.y0, self.y1):
+                self.SetEndContact(w, self.y0, self.y1, w.y0, w.y1, CONTACT_LEFT)
             #Then try right, so look for connection left of V walls
-            for w in ListWall:
-                if self.x1 == w.x0:
-                    if self.y0 > w.y0 and self.y0 < w.y1:
-                        #There is a contact, compute starting and ending point
-                        start_contact = self.y0 - w.y0
-                        end_contact = min(self.y1, w.y1) - w.y0
-                        self.Contact |= CONTACT_RIGHT
-                        contact = Contact(start_contact, end_contact, CONTACT_RIGHT)
-                        w.AddContact(contact)
-                    elif self.y1 < w.y1 and self.y1 > w.y0:
-                        #There is a contact, compute starting and ending point
-                        start_contact = max(self.y0, w.y0) - w.y0
-                        end_contact = self.y1 - w.y0
-                        self.Contact |= CONTACT_RIGHT
-                        contact = Contact(start_contact, end_contact, CONTACT_RIGHT)
-                        w.AddContact(contact)
+            for w in Index.Candidates(Index.StartMap, self.ix1, self.y0, self.y1):
+                self.SetEndContact(w, self.y0, self.y1, w.y0, w.y1, CONTACT_RIGHT)
+
+    #   Check for an end contact between this wall and the wall w of the other list
+    #   s0, s1 are the start and end of this wall along w, w0, w1 the start and end of w
+    #   If there is a contact, add it to w contact list
+    def SetEndContact(self, w, s0, s1, w0, w1, direction):
+        if s0 > w0 and s0 < w1:
+            #There is a contact, compute starting and ending point
+            start_contact = s0 - w0
+            end_contact = min(s1, w1) - w0
+        elif s1 < w1 and s1 > w0:
+            #There is a contact, compute starting and ending point
+            start_contact = max(s0, w0) - w0
+            end_contact = s1 - w0
+        else:
+            return
+        self.Contact |= direction
+        contact = Contact(start_contact, end_contact, direction)
+        w.AddContact(contact)
     
-    #Look for crossing rectangles within the other side list.
-    #Only one pass is needed, as this methode set up the 2 crossings
-    #Should be called with self = H wall and List V Walls
+    #Record a crossing between this wall (H wall) and the V wall w
+    #The 2 crossings are set up, one in each wall
     #The shortest wall will be with the top cut
-    #As the list are sorted, no need to sort in the built list of crosspoints
-
-    def LookForCrossContact(self,ListWall):
-        HasCrossing = False
-        TypeCrossing = False
-        for w in ListWall:      #Try all V walls
-            #They are crossing if...
-            if self.x0 < w.x0 and self.x1 > w.x1 and self.y0 > w.y0 and self.y1 < w.y1:
-                #All crossing of a wall should be the same, so copy the status of the first one
-                if ( not HasCrossing  ):
-                    locShort = self.length < w.length
-                else:
-                    locShort = TypeCrossing
-                TypeCrossing = locShort
-                HasCrossing = True
-                #Compute local (H) crossPoint, only start point is needed as cut is always thickness wide
-                locCrossPoint = (round(w.x0 - self.x0, 1), locShort)
-                #Then distant (V) crosspoint
-                remCrossPoint = (round(self.y0 - w.y0, 1), not locShort)
-                self.CrossList.append(locCrossPoint)
-                w.CrossList.append(remCrossPoint)
-
-
-    def DrawWall(self, group, xpos, ypos):
-        PositionInPage = [xpos, ypos]
+    def AddCrossing(self, w):
+        #All crossing of a wall should be the same, so copy the status of the first one
+        if len(self.CrossList) == 0:
+            locShort = self.length < w.length
+        else:
+            locShort = self.CrossList[0][1]
+        #Compute local (H) crossPoint, only start point is needed as cut is always thickness wide
+        locCrossPoint = (round(w.x0 - self.x0, 1), locShort)
+        #Then distant (V) crosspoint
+        remCrossPoint = (round(self.y0 - w.y0, 1), not locShort)
+        self.CrossList.append(locCrossPoint)
+        w.CrossList.append(remCrossPoint)
+
+
+    #   Key of the wall path in the path cache : a hash of everything the wall outline depends on
+    #   Walls with the same key have the same outline, wherever they are in the box
+    def CacheKey(self, ctx, NotchPlan):
+        Contacts = [(c.direction, c.start, c.end) for c in self.ContactList]
+        Shape = (self.length, self.Contact, Contacts, self.CrossList, NotchPlan, ctx.hasbottom,
+                 ctx.thickness, ctx.height, ctx.burn_factor, ctx.OptimizeCuts)
+        return hashlib.sha1(repr(Shape).encode()).hexdigest()
+
+    #   Draw the wall, NotchPlan is the plan of the bottom notches of this wall (see PlanBottomNotches)
+    #   Return the path of the wall, not yet placed in the page
+    def DrawWall(self, ctx, NotchPlan):
+        thickness = ctx.thickness
+        height = ctx.height
+        burn_factor = ctx.burn_factor
+        zNotchesSize = ctx.zNotchesSize
+        #   Attributes are read once, they are computed when the wall is a WallView
+        length = self.length
+        EndContact = self.Contact
+        CrossList = self.CrossList
         name = "wall" + self.id
-        path = th_inkscape_path(PositionInPage, group, name)
-        DebugMsg("Creating path("+name+") Position ="+str(PositionInPage)+", Length="+str(self.length)+'\n')
+        path = PathBuilder(name)
+        ctx.DebugMsg("Creating path(%s) Length=%s\n", name, length)
         path.MoveTo(0, 0)
         #Draw upper side, no notches, but could have crossing(s)
-        for cross in self.CrossList:
+        for cross in CrossList:
             if cross[1]:
                 path.LineTo(cross[0], 0)
                 path.LineToVRel(height/2.0)
                 path.LineToHRel(thickness)
                 path.LineToVRel(-height/2.0)
 
-        path.LineTo(self.length, 0)     #Go to end of line
+        path.LineTo(length, 0)     #Go to end of line
         #Now draw right side, with notches if there is a contact
-        if (self.Contact & CONTACT_RIGHT) or (self.Contact & CONTACT_TOP):
-            for i in range(zNotches):
-                path.LineTo(self.length, zNotchesSize + 2*i*zNotchesSize - burn_factor)
-                path.LineToHRel(thickness)
-                path.LineToVRel(zNotchesSize/2.0 + 2*burn_factor)
-                path.LineToHRel(-thickness)
-                path.LineToVRel(zNotchesSize/2.0)
-        path.LineTo(self.length, height)
+        if (EndContact & CONTACT_RIGHT) or (EndContact & CONTACT_TOP):
+            path.AppendBlock(SideNotchOutline(ctx.zNotchesRight, zNotchesSize, thickness, burn_factor), length)
+        path.LineTo(length, height)
         #Now draw bottom side (reverse)
         #This line has notches (if bottom is present) and could have crossings
-        lastPos = self.length
-        for cross in reversed(self.CrossList):
-            DebugMsg("lastPos="+str(lastPos)+"cross[0]="+str(cross[0])+'\n')
+        #The plan holds the segments between crossings, in drawing order
+        Segments = iter(NotchPlan)
+        for cross in reversed(CrossList):
+            ctx.DebugMsg("cross[0]=%s\n", cross[0])
             if not cross[1]:
-                l = lastPos - cross[0] - thickness
-                if  l < 20:
-                    lNotches = 0
-                    lNotchesSize = 0
-                elif l < 30:
-                    lNotches = 1
-                    lNotchesSize = l / 3
-                elif l < 100:
-                    lNotches = int((l / 10.0 - 1)/2)
-                    lNotchesSize = l / (2*lNotches + 1)
-                elif l < 150:
-                    lNotches = int((l / 15.0 - 1)/2)
-                    lNotchesSize = l / (2*lNotches + 1)
-                else:
-                    lNotches = int((l / 20.0 - 1)/2)
-                    lNotchesSize = l / (2*lNotches + 1)
-                if  hasbottom:
-                    for i in range(lNotches):
-                        if self.vertical:
-                            xStart = self.x0
-                            xEnd = self.x1
-                            yStart = self.y0 + lastPos - lNotchesSize - 2*i*lNotchesSize
-                            yEnd = yStart - lNotchesSize
-                        else:
-                            xStart = self.x0 + lastPos - lNotchesSize - 2*i*lNotchesSize
-                            xEnd = xStart - lNotchesSize
-                            yStart = self.y0
-                            yEnd = self.y1
-                        path.LineTo(lastPos - lNotchesSize - 2*i*lNotchesSize + burn_factor, height)
-                        path.LineToVRel(thickness)
-                        path.LineToHRel(-lNotchesSize - 2*burn_factor)
-                        path.LineToVRel(-thickness)
-                        BottomHoles.append((xStart, yStart, xEnd, yEnd))
+                self.DrawBottomNotches(ctx, path, next(Segments))
                 path.LineTo(cross[0] + thickness, height)
                 path.LineToVRel(-height/2.0)
                 path.LineToHRel(-thickness)
                 path.LineTo(cross[0], height)
-                lastPos = cross[0]
 
-        DebugMsg("Last or no Cross, lastPos="+str(lastPos)+'\n')
-
-        l = lastPos
-        if  l < 20:
-            lNotches = 0
-            lNotchesSize = 0
-        elif l < 30:
-            lNotches = 1
-            lNotchesSize = l / 3
-        elif l < 100:
-            lNotches = int((l / 10.0 - 1)/2)
-            lNotchesSize = l / (2*lNotches + 1)
-        elif l < 150:
-            lNotches = int((l / 15.0 - 1)/2)
-            lNotchesSize = l / (2*lNotches + 1)
-        else:
-            lNotches = int((l / 20.0 - 1)/2)
-            lNotchesSize = l / (2*lNotches + 1)
-        if  hasbottom:
-            for i in range(lNotches):
-                if self.vertical:
-                    xStart = self.x0
-                    xEnd = self.x1
-                    yStart = self.y0 + lastPos - lNotchesSize - 2*i*lNotchesSize
-                    yEnd = yStart - lNotchesSize
-                else:
-                    xStart = self.x0 + lastPos - lNotchesSize - 2*i*lNotchesSize
-                    xEnd = xStart - lNotchesSize
-                    yStart = self.y0
-                    yEnd = self.y1
-                path.LineTo(lastPos - lNotchesSize - 2*i*lNotchesSize + burn_factor, height)
-                path.LineToVRel(thickness)
-                path.LineToHRel(-lNotchesSize - 2*burn_factor)
-                path.LineToVRel(-thickness)
-                BottomHoles.append((xStart, yStart, xEnd, yEnd))
-                DebugMsg("Add BottomHoles, xStart="+str(xStart)+", xEnd"+str(xEnd)+", yStart="+str(yStart)+", yStart="+str(yEnd)+'\n')
+        self.DrawBottomNotches(ctx, path, next(Segments))
         path.LineTo(0, height)
         #then left side
-        if (self.Contact & CONTACT_LEFT) or (self.Contact & CONTACT_BOTTOM):
-            for i in range(zNotches):
-                path.LineTo(0, height - zNotchesSize - 2*i*zNotchesSize + burn_factor)
-                path.LineToHRel(-thickness)
-                path.LineToVRel(-zNotchesSize/2.0 -2*burn_factor)
-                path.LineToHRel(thickness)
-                path.LineToVRel(-zNotchesSize/2.0)
+        if (EndContact & CONTACT_LEFT) or (EndContact & CONTACT_BOTTOM):
+            path.AppendBlock(SideNotchOutline(ctx.zNotchesLeft, -zNotchesSize, -thickness, -burn_factor), 0)
         path.LineTo(0, 0)
 
         #Then draw holes if necessary
@@ -394,14 +903,971 @@ class wall:
             Offset = 0
             if contact.direction == CONTACT_LEFT or contact.direction == CONTACT_TOP:
                 Offset = zNotchesSize/2.0
-            for i in range(zNotches):
-                path.MoveTo(contact.start, zNotchesSize + 2*i*zNotchesSize + Offset)
-                path.LineToHRel(contact.end-contact.start)
-                path.LineToVRel(zNotchesSize/2.0)
-                path.LineToHRel(contact.start-contact.end)
-                path.LineToVRel(-zNotchesSize/2.0)
+            path.AppendBlock(HoleOutline(contact.end-contact.start, ctx.zNotchesRight, Offset, zNotchesSize), contact.start)
         path.Close()
-        path.GenPath()
+        return path
+
+    #   Draw the bottom notches of one segment, Segment is (segment end, segment length)
+    def DrawBottomNotches(self, ctx, path, Segment):
+        if ctx.hasbottom:
+            End, Length = Segment
+            path.AppendBlock(BottomNotchOutline(Length, ctx.thickness, ctx.burn_factor, ctx.height)[2], End)
+
+
+#   Notch outlines are pure functions of the segment length and of the box parameters,
+#   the same few lengths repeat many times in a grid, so outlines are drawn once and memoised.
+#   Each one returns a block for PathBuilder.AppendBlock, with x relative to the place it is appended at.
+
+#   Bottom notches of a segment of length l, drawn from the end of the segment (x = 0) towards its start
+#   The number of notches depends on l : none if l < 20, one if l < 30,
+#   then one notch for each 10 (l < 100), 15 (l < 150) or 20 of length. The notch i starts at -size - 2*i*size.
+#   Return (number of notches, notch size, block)
+@functools.lru_cache(maxsize=NOTCH_CACHE_SIZE)
+def BottomNotchOutline(length, thickness, burn_factor, height):
+    if length < 20:
+        Count = 0
+    elif length < 30:
+        Count = 1
+    elif length < 100:
+        Count = int((length / 10.0 - 1)/2)
+    elif length < 150:
+        Count = int((length / 15.0 - 1)/2)
+    else:
+        Count = int((length / 20.0 - 1)/2)
+    Size = length / (2*Count + 1) if Count > 0 else 0.0
+    path = PathBuilder('notches')
+    for i in range(Count):
+        path.LineTo(-Size - 2*i*Size + burn_factor, height)
+        path.LineToVRel(thickness)
+        path.LineToHRel(-Size - 2*burn_factor)
+        path.LineToVRel(-thickness)
+    return Count, Size, path.Block()
+
+#   Notches of a side of the wall, at x = 0, Positions are the starts of the notches along the side
+#   The right side is drawn downwards, the left side upwards with NotchSize, thickness and burn_factor negated
+@functools.lru_cache(maxsize=NOTCH_CACHE_SIZE)
+def SideNotchOutline(Positions, NotchSize, thickness, burn_factor):
+    path = PathBuilder('notches')
+    for zPos in Positions:
+        path.LineTo(0, zPos - burn_factor)
+        path.LineToHRel(thickness)
+        path.LineToVRel(NotchSize/2.0 + 2*burn_factor)
+        path.LineToHRel(-thickness)
+        path.LineToVRel(NotchSize/2.0)
+    return path.Block()
+
+#   Holes of a contact of the given width, starting at x = 0, shifted down by Offset on the left and top sides
+@functools.lru_cache(maxsize=NOTCH_CACHE_SIZE)
+def HoleOutline(width, Positions, Offset, NotchSize):
+    path = PathBuilder('holes')
+    for zPos in Positions:
+        path.MoveTo(0, zPos + Offset)
+        path.LineToHRel(width)
+        path.LineToVRel(NotchSize/2.0)
+        path.LineToHRel(-width)
+        path.LineToVRel(-NotchSize/2.0)
+    return path.Block()
+
+NOTCH_OUTLINES = (BottomNotchOutline, SideNotchOutline, HoleOutline)
+
+#   Total hits and misses of the notch outline caches, since the start of the process
+def NotchCacheCounts():
+    Infos = [f.cache_info() for f in NOTCH_OUTLINES]
+    return sum(Info.hits for Info in Infos), sum(Info.misses for Info in Infos)
+
+
+class WallStore:
+    '''
+    Compact storage of walls, once their contacts and crossings are known.
+    Walls are rows of a NumPy structured array, contacts and crossings of all walls are held in flat arrays,
+    those of wall i are the rows ContactPtr[i]:ContactPtr[i+1] and CrossPtr[i]:CrossPtr[i+1] (CSR layout).
+    Walls are then accessed through WallView, with the same attributes as wall.
+    '''
+    WALL_DTYPE = np.dtype([('x0', 'f8'), ('y0', 'f8'), ('x1', 'f8'), ('y1', 'f8'), ('w', 'f8'), ('h', 'f8'), ('length', 'f8'),
+                           ('ix0', 'i8'), ('iy0', 'i8'), ('ix1', 'i8'), ('iy1', 'i8'), ('Contact', 'u1'), ('vertical', '?')])
+    CONTACT_DTYPE = np.dtype([('start', 'f8'), ('end', 'f8'), ('direction', 'u1')])
+    CROSS_DTYPE = np.dtype([('pos', 'f8'), ('short', '?')])
+
+    def __init__(self, Walls):
+        self.Ids = [w.id for w in Walls]
+        self.Walls = np.array([(w.x0, w.y0, w.x1, w.y1, w.w, w.h, w.length, w.ix0, w.iy0, w.ix1, w.iy1, w.Contact, w.vertical)
+                               for w in Walls], dtype=self.WALL_DTYPE)
+        self.ContactPtr = np.concatenate(([0], np.cumsum([len(w.ContactList) for w in Walls], dtype=np.int64)))
+        self.Contacts = np.array([(c.start, c.end, c.direction) for w in Walls for c in w.ContactList], dtype=self.CONTACT_DTYPE)
+        self.CrossPtr = np.concatenate(([0], np.cumsum([len(w.CrossList) for w in Walls], dtype=np.int64)))
+        self.Crosses = np.array([cross for w in Walls for cross in w.CrossList], dtype=self.CROSS_DTYPE)
+        #   Columns, as views of the structured array, to read one value with item()
+        self.Columns = {Name: self.Walls[Name] for Name in self.WALL_DTYPE.names}
+
+    def __len__(self):
+        return len(self.Ids)
+
+    def View(self, i):
+        return WallView(self, i)
+
+
+#   Property of WallView reading the column Name of the store
+def WallColumn(Name):
+    return property(lambda self: self.Store.Columns[Name].item(self.Index))
+
+class WallView:
+    '''
+    Read only view of the wall i of a WallStore, with the attributes of wall and its drawing methods.
+    Contact and cross lists are rebuilt from the store each time they are read.
+    '''
+    __slots__ = ('Store', 'Index')
+
+    def __init__(self, Store, Index):
+        self.Store = Store
+        self.Index = Index
+
+    x0 = WallColumn('x0')
+    y0 = WallColumn('y0')
+    x1 = WallColumn('x1')
+    y1 = WallColumn('y1')
+    w = WallColumn('w')
+    h = WallColumn('h')
+    length = WallColumn('length')
+    ix0 = WallColumn('ix0')
+    iy0 = WallColumn('iy0')
+    ix1 = WallColumn('ix1')
+    iy1 = WallColumn('iy1')
+    Contact = WallColumn('Contact')
+    vertical = WallColumn('vertical')
+
+    @property
+    def id(self):
+        return self.Store.Ids[self.Index]
+
+    @property
+    def ContactList(self):
+        Store = self.Store
+        Rows = Store.Contacts[Store.ContactPtr[self.Index]:Store.ContactPtr[self.Index + 1]]
+        return [Contact(start, end, direction) for start, end, direction in Rows.tolist()]
+
+    @property
+    def ContactStarts(self):
+        Store = self.Store
+        return Store.Contacts['start'][Store.ContactPtr[self.Index]:Store.ContactPtr[self.Index + 1]].tolist()
+
+    @property
+    def CrossList(self):
+        Store = self.Store
+        return Store.Crosses[Store.CrossPtr[self.Index]:Store.CrossPtr[self.Index + 1]].tolist()
+
+    __str__ = wall.__str__
+    CacheKey = wall.CacheKey
+    DrawWall = wall.DrawWall
+    DrawBottomNotches = wall.DrawBottomNotches
+
+#   Replace the walls of the context by views of a WallStore, once contacts and crossings are found
+#   The wall objects and their lists are released, the views are small objects
+def CompactWallLists(ctx):
+    nHorizontal = len(ctx.HorizontalWalls)
+    Store = WallStore(ctx.HorizontalWalls + ctx.VerticalWalls)
+    ctx.HorizontalWalls = [Store.View(i) for i in range(nHorizontal)]
+    ctx.VerticalWalls = [Store.View(i) for i in range(nHorizontal, len(Store))]
+
+
+#   Snap coordinates which are within tolerance of each other to the same value
+#   Sorted coordinates are grouped from the smallest one : a group holds the coordinates not greater than
+#   its first one + tolerance, so that a group never spans more than tolerance, even when the gaps between
+#   its coordinates are small. Each group is replaced by its mean rounded to 0.1.
+#   Return the snapped coordinates and their integer keys (the coordinates in tenths)
+def SnapCoordinates(Values, tolerance):
+    Values = np.asarray(Values, dtype=float)
+    Keys = np.empty(len(Values), dtype=np.int64)
+    if len(Values):
+        Distinct, Inverse = np.unique(Values, return_inverse=True)
+        #   One search per group, groups are far fewer than coordinates
+        Group = np.empty(len(Distinct), dtype=np.int64)
+        Start = 0
+        n = 0
+        while Start < len(Distinct):
+            End = int(np.searchsorted(Distinct, Distinct[Start] + tolerance, side='right'))
+            Group[Start:End] = n
+            n += 1
+            Start = End
+        Group = Group[Inverse.reshape(-1)]
+        Mean = np.bincount(Group, weights=Values) / np.bincount(Group)
+        Keys[:] = np.rint(Mean * 10)[Group]
+    return Keys / 10.0, Keys
+
+#   Snapping stage, run once all walls are added
+#   x and y coordinates of all wall sides are snapped with the context tolerance, so that walls which are
+#   almost aligned (unit conversions, manual drawing) are matched through the integer keys of their sides.
+#   The bounding box is computed from the snapped coordinates.
+def SnapWalls(ctx):
+    Walls = ctx.HorizontalWalls + ctx.VerticalWalls
+    if len(Walls) == 0:
+        return
+    n = len(Walls)
+    X, XKeys = SnapCoordinates([w.x0 for w in Walls] + [w.x1 for w in Walls], ctx.tolerance)
+    Y, YKeys = SnapCoordinates([w.y0 for w in Walls] + [w.y1 for w in Walls], ctx.tolerance)
+    for w, x0, x1, ix0, ix1, y0, y1, iy0, iy1 in zip(Walls, X[:n].tolist(), X[n:].tolist(), XKeys[:n].tolist(), XKeys[n:].tolist(),
+                                                     Y[:n].tolist(), Y[n:].tolist(), YKeys[:n].tolist(), YKeys[n:].tolist()):
+        w.x0, w.x1, w.ix0, w.ix1 = x0, x1, ix0, ix1
+        w.y0, w.y1, w.iy0, w.iy1 = y0, y1, iy0, iy1
+        w.w = (ix1 - ix0) / 10.0
+        w.h = (iy1 - iy0) / 10.0
+        w.length = w.h if w.vertical else w.w
+    ctx.BoundingBox = [float(X[:n].min()), float(Y[:n].min()), float(X[n:].max()), float(Y[n:].max())]
+
+#   Sort a list of walls with the same orientation, once all walls have been added
+#   If the walls are vertical, sort by x then y
+#   If the walls are horizontal, sort by y then x
+#   Then check in a single pass that no 2 walls have the same starting point
+def SortWalls(ListWall, vertical):
+    if vertical:
+        ListWall.sort(key=lambda w: (w.x0, w.y0))
+    else:
+        ListWall.sort(key=lambda w: (w.y0, w.x0))
+    for i in range(1, len(ListWall)):
+        if ListWall[i].x0 == ListWall[i-1].x0 and ListWall[i].y0 == ListWall[i-1].y0:
+            inkex.errormsg("At least 2 walls with same starting point\n")
+
+#Look for crossing rectangles between the H walls and the V walls.
+#This is a sweep line along x : H walls are active between their ends, and for each V wall
+#the active H walls are searched by y within the V wall extent.
+#Crossings are then recorded in list order (H then V), so that cross lists stay sorted.
+def LookForCrossContacts(HorizontalWalls, VerticalWalls):
+    HOrder = sorted(range(len(HorizontalWalls)), key=lambda i: HorizontalWalls[i].x0)
+    VOrder = sorted(range(len(VerticalWalls)), key=lambda j: VerticalWalls[j].x0)
+    Active = []         #   Active H walls, sorted by (y0, index)
+    ActiveEnds = []     #   Heap of (x1, index) of the active H walls
+    Crossings = []
+    k = 0
+    for j in VOrder:
+        v = VerticalWalls[j]
+        #Activate H walls starting strictly before the V wall
+        while k < len(HOrder) and HorizontalWalls[HOrder[k]].x0 < v.x0:
+            i = HOrder[k]
+            bisect.insort(Active, (HorizontalWalls[i].y0, i))
+            heapq.heappush(ActiveEnds, (HorizontalWalls[i].x1, i))
+            k += 1
+        #Then remove H walls which end before the V wall, they could not cross this one or the next ones
+        while ActiveEnds and ActiveEnds[0][0] <= v.x0:
+            x1, i = heapq.heappop(ActiveEnds)
+            del Active[bisect.bisect_left(Active, (HorizontalWalls[i].y0, i))]
+        #Active H walls with v.y0 < y0 < v.y1 are candidates
+        first = bisect.bisect_right(Active, (v.y0, len(HorizontalWalls)))
+        last = bisect.bisect_left(Active, (v.y1, -1))
+        for y0, i in Active[first:last]:
+            h = HorizontalWalls[i]
+            #They are crossing if...
+            if h.x1 > v.x1 and h.y1 < v.y1:
+                Crossings.append((i, j))
+    Crossings.sort()
+    for i, j in Crossings:
+        HorizontalWalls[i].AddCrossing(VerticalWalls[j])
+
+
+#   Plan the bottom notches of all walls at once
+#   The bottom side of each wall is cut in segments by the crossings cut from the bottom.
+#   The notches of a segment only depend on its length (see BottomNotchOutline), which gives the number and size
+#   of the notches of each different length. The notch i starts at end - size - 2*i*size.
+#   All notches of all walls are computed with arrays, the matching bottom holes are added to the context.
+#   Return for each wall the list of its segments in drawing order, each one is (segment end, segment length)
+def PlanBottomNotches(ctx, Walls):
+    SegmentEnd = []
+    SegmentLength = []
+    WallSegments = []
+    for w in Walls:
+        lastPos = w.length
+        nSegments = 1
+        for cross in reversed(w.CrossList):
+            if not cross[1]:
+                SegmentEnd.append(lastPos)
+                SegmentLength.append(lastPos - cross[0] - ctx.thickness)
+                lastPos = cross[0]
+                nSegments += 1
+        SegmentEnd.append(lastPos)
+        SegmentLength.append(lastPos)
+        WallSegments.append(nSegments)
+
+    End = np.array(SegmentEnd, dtype=float)
+    l = np.array(SegmentLength, dtype=float)
+    Lengths, Inverse = np.unique(l, return_inverse=True)
+    Ladder = [BottomNotchOutline(Length, ctx.thickness, ctx.burn_factor, ctx.height)[:2] for Length in Lengths.tolist()]
+    Count = np.array([Notches for Notches, Size in Ladder], dtype=int)[Inverse.reshape(-1)]
+    Size = np.array([Size for Notches, Size in Ladder], dtype=float)[Inverse.reshape(-1)]
+    if not ctx.hasbottom:
+        Count[:] = 0
+
+    #   One entry per notch : its segment and its rank i within the segment
+    NotchSegment = np.repeat(np.arange(len(l)), Count)
+    Rank = np.arange(len(NotchSegment)) - (np.cumsum(Count) - Count)[NotchSegment]
+    NotchSize = Size[NotchSegment]
+
+    if len(NotchSegment):
+        #   Bottom holes, in the box coordinates
+        NotchWall = np.repeat(np.arange(len(Walls)), WallSegments)[NotchSegment]
+        Vertical = np.array([w.vertical for w in Walls])[NotchWall]
+        X0 = np.array([w.x0 for w in Walls])[NotchWall]
+        Y0 = np.array([w.y0 for w in Walls])[NotchWall]
+        X1 = np.array([w.x1 for w in Walls])[NotchWall]
+        Y1 = np.array([w.y1 for w in Walls])[NotchWall]
+        Start = np.where(Vertical, Y0, X0) + End[NotchSegment] - NotchSize - 2*Rank*NotchSize
+        Stop = Start - NotchSize
+        xStart = np.where(Vertical, X0, Start)
+        xEnd = np.where(Vertical, X1, Stop)
+        yStart = np.where(Vertical, Start, Y0)
+        yEnd = np.where(Vertical, Stop, Y1)
+        Holes = list(zip(xStart.tolist(), yStart.tolist(), xEnd.tolist(), yEnd.tolist()))
+        ctx.BottomHoles.extend(Holes)
+        if ctx.fDebug:
+            for hole in Holes:
+                ctx.DebugMsg("Add BottomHoles, xStart=%s, xEnd%s, yStart=%s, yStart=%s\n", hole[0], hole[2], hole[1], hole[3])
+
+    Segments = list(zip(SegmentEnd, SegmentLength))
+    Plans = []
+    k = 0
+    for nSegments in WallSegments:
+        Plans.append(Segments[k:k + nSegments])
+        k += nSegments
+    return Plans
+
+def SamePoint(p0, p1):
+    return abs(p0[0] - p1[0]) < EPSILON and abs(p0[1] - p1[1]) < EPSILON
+
+#   Remove null segments, and merge consecutive collinear segments going in the same direction
+def MergeSegments(Points):
+    Merged = [Points[0]]
+    for p in Points[1:]:
+        if SamePoint(p, Merged[-1]):
+            continue
+        if len(Merged) > 1:
+            x0, y0 = Merged[-2]
+            x1, y1 = Merged[-1]
+            #   Cross product null : collinear, dot product positive : same direction
+            Cross = (x1 - x0) * (p[1] - y1) - (y1 - y0) * (p[0] - x1)
+            Dot = (x1 - x0) * (p[0] - x1) + (y1 - y0) * (p[1] - y1)
+            if abs(Cross) < EPSILON and Dot > 0:
+                Merged[-1] = p
+                continue
+        Merged.append(p)
+    return Merged
+
+#   Order the cuts starting at Starts (the start of each cut, which is also its end as cuts are closed)
+#   to reduce the travel from Origin through all cuts and back to Origin.
+#   The tour is built with the nearest neighbour heuristic, then improved with 2-opt moves.
+#   Only moves creating an edge towards one of the CUT_NEIGHBOURS nearest cuts are tried,
+#   so that each pass is linear in the number of cuts.
+#   Return the order, as indices in Starts
+def PlanCutOrder(Origin, Starts):
+    n = len(Starts)
+    if n < 2:
+        return list(range(n))
+    Points = np.array(Starts, dtype=float)
+    Order = []
+    Remaining = np.ones(n, dtype=bool)
+    Current = np.array(Origin, dtype=float)
+    for k in range(n):
+        Distance = np.hypot(Points[:, 0] - Current[0], Points[:, 1] - Current[1])
+        Distance[~Remaining] = np.inf
+        i = int(np.argmin(Distance))
+        Order.append(i)
+        Remaining[i] = False
+        Current = Points[i]
+
+    #   Nearest cuts of each cut, computed by blocks of rows to bound the memory used
+    nNeighbours = min(CUT_NEIGHBOURS, n - 1)
+    Neighbours = []
+    for i0 in range(0, n, 256):
+        Block = Points[i0:i0+256]
+        Distance = np.hypot(Block[:, 0, None] - Points[:, 0], Block[:, 1, None] - Points[:, 1])
+        Distance[np.arange(len(Block)), np.arange(i0, i0 + len(Block))] = np.inf
+        Near = np.argpartition(Distance, nNeighbours - 1, axis=1)[:, :nNeighbours]
+        Neighbours.extend(Near.tolist())
+    #   and of Origin, so that the first edge of the tour is improved as well
+    Distance = np.hypot(Points[:, 0] - Origin[0], Points[:, 1] - Origin[1])
+    Neighbours.append(np.argpartition(Distance, nNeighbours - 1)[:nNeighbours].tolist())
+
+    #   2-opt on the tour Origin, cuts, Origin (Origin has index n) : reversing Tour[t+1..u]
+    #   replaces edges (a, b) = (Tour[t], Tour[t+1]) and (c, d) = (Tour[u], Tour[u+1]) by (a, c) and (b, d)
+    X = Points[:, 0].tolist() + [Origin[0]]
+    Y = Points[:, 1].tolist() + [Origin[1]]
+    Tour = [n] + Order + [n]
+    Position = [0] * (n + 1)
+    for t in range(1, n + 1):
+        Position[Tour[t]] = t
+    hypot = math.hypot
+    for Pass in range(MAX_2OPT_PASSES):
+        Improved = False
+        for t in range(0, n - 1):
+            a = Tour[t]
+            b = Tour[t+1]
+            ab = hypot(X[a] - X[b], Y[a] - Y[b])
+            for c in Neighbours[a]:
+                u = Position[c]
+                if u <= t + 1:
+                    continue
+                d = Tour[u+1]
+                Gain = ab + hypot(X[c] - X[d], Y[c] - Y[d]) - hypot(X[a] - X[c], Y[a] - Y[c]) - hypot(X[b] - X[d], Y[b] - Y[d])
+                if Gain > EPSILON:
+                    Tour[t+1:u+1] = Tour[u:t:-1]
+                    for k in range(t + 1, u + 1):
+                        Position[Tour[k]] = k
+                    b = c
+                    ab = hypot(X[a] - X[b], Y[a] - Y[b])
+                    Improved = True
+        if not Improved:
+            break
+    return Tour[1:-1]
+
+#   Generate the walls and the bottom of a box, once all walls are added to the context
+#   The paths are written to sink (see TreeSink and StreamSink)
+def GenerateBox(ctx, sink):
+    Stats = ctx.Stats
+    FindContacts(ctx)
+    if ctx.Streaming and not (ctx.SheetWidth > 0 and ctx.SheetHeight > 0):
+        #   Each panel is drawn, placed and written before the next one is drawn
+        if Stats:
+            Stats.Phase('generate')
+        PlacePanels(ctx, IterPanels(ctx), sink)
+        if Stats:
+            Stats.Phase(None)
+            Stats.CountBox(ctx, None)
+        return
+    Panels = DrawPanels(ctx)
+    if Stats:
+        Stats.Phase('place')
+    PlacePanels(ctx, Panels, sink)
+    if Stats:
+        Stats.Phase(None)
+        Stats.CountBox(ctx, Panels)
+
+#   Find the end contacts and the crossings of the walls, then compact the walls if asked for
+def FindContacts(ctx):
+    Stats = ctx.Stats
+    if Stats:
+        Stats.Phase('contacts')
+    FindEndContacts(ctx)
+    if Stats:
+        Stats.Phase('crosses')
+    FindCrossContacts(ctx)
+    if ctx.CompactWalls:
+        if Stats:
+            Stats.Phase('compact')
+        CompactWallLists(ctx)
+
+#   Draw the walls, then the bottom and optimise the cuts if needed. Return the panels, not yet placed
+def DrawPanels(ctx):
+    Stats = ctx.Stats
+    # After this step, generate the walls
+    if Stats:
+        Stats.Phase('draw')
+    Panels = DrawWalls(ctx)
+    #And last the bottom layer, if needed
+    if ctx.hasbottom:
+        if Stats:
+            Stats.Phase('bottom')
+        Panels.append(DrawBottom(ctx))
+    if ctx.OptimizeCuts:
+        if Stats:
+            Stats.Phase('optimize')
+        OptimizePanels(Panels)
+    return Panels
+
+#   Compute a box of the multi-box mode, run by a worker thread (see drawerbox.GenerateBoxes)
+#   Nothing is written to the document here, the panels are placed and written by the main thread
+def ComputeBox(ctx):
+    FindContacts(ctx)
+    return DrawPanels(ctx)
+
+#   Snap and sort the walls, then look for the end contacts between H and V walls
+def FindEndContacts(ctx):
+    SnapWalls(ctx)
+    #   Lists built by AddRectangles are already sorted, unless snapping changed the order
+    #   This also checks for walls with the same starting point
+    SortWalls(ctx.HorizontalWalls, False)
+    SortWalls(ctx.VerticalWalls, True)
+
+    #   Index both lists on the coordinates of the wall ends
+    #   so that contact search only visit the walls at the matching coordinate
+    HorizontalIndex = WallIndex(ctx.HorizontalWalls, False)
+    VerticalIndex = WallIndex(ctx.VerticalWalls, True)
+
+    #   Now for each H wall, look for end contact with a V wall
+    for w in ctx.HorizontalWalls:
+        w.LookForEndContact(VerticalIndex)
+
+    #   Now for each V wall, look for end contact with a H wall
+    for w in ctx.VerticalWalls:
+        w.LookForEndContact(HorizontalIndex)
+
+    if ctx.fDebug:
+        ctx.DebugMsg("After End contact\n  Horizontal walls :%d\n", len(ctx.HorizontalWalls))
+        for w in ctx.HorizontalWalls:
+            ctx.DebugMsg(str(w))
+        ctx.DebugMsg("Vertical walls :%d\n", len(ctx.VerticalWalls))
+        for w in ctx.VerticalWalls:
+            ctx.DebugMsg(str(w))
+
+        ctx.DebugMsg("Fin contact\n")
+
+def FindCrossContacts(ctx):
+    LookForCrossContacts(ctx.HorizontalWalls, ctx.VerticalWalls)
+    if ctx.fDebug:
+        ctx.DebugMsg("After Cross contact\n Horizontal walls :%d\n", len(ctx.HorizontalWalls))
+        for w in ctx.HorizontalWalls:
+            ctx.DebugMsg(str(w))
+        ctx.DebugMsg("Vertical walls :%d\n", len(ctx.VerticalWalls))
+        for w in ctx.VerticalWalls:
+            ctx.DebugMsg(str(w))
+
+#   Draw the paths of all walls, H walls first. Return the list of paths, not yet placed
+def DrawWalls(ctx):
+    return list(IterWalls(ctx))
+
+#   Draw the walls one by one, yield the path of each wall, not yet placed
+def IterWalls(ctx):
+    CacheStart = NotchCacheCounts()
+    NotchPlans = PlanBottomNotches(ctx, ctx.HorizontalWalls + ctx.VerticalWalls)
+    if ctx.PathCache is None and not ctx.Deduplicate:
+        for w, NotchPlan in zip(ctx.HorizontalWalls + ctx.VerticalWalls, NotchPlans):
+            yield w.DrawWall(ctx, NotchPlan)
+        ReportNotchCache(ctx, CacheStart)
+        return
+    #   Only walls which are not in the cache are drawn, and with Deduplicate only the first wall of each key
+    Unique = {}
+    nWalls = 0
+    nHits = 0
+    for w, NotchPlan in zip(ctx.HorizontalWalls + ctx.VerticalWalls, NotchPlans):
+        Key = w.CacheKey(ctx, NotchPlan)
+        Cached = ctx.PathCache.get(Key) if ctx.PathCache else None
+        if ctx.Deduplicate and Key in Unique:
+            path = PathBuilder("wall" + w.id)
+            path.Original = Unique[Key]
+            path.Original.Quantity += 1
+        elif Cached:
+            path = PathBuilder("wall" + w.id)
+            path.CachedData, path.CachedBox = Cached
+            nHits += 1
+        else:
+            path = w.DrawWall(ctx, NotchPlan)
+        path.Key = Key
+        Unique.setdefault(Key, path)
+        nWalls += 1
+        yield path
+    ctx.DebugMsg("Walls : %d, different outlines : %d, reused from cache : %d\n", nWalls, len(Unique), nHits)
+    ReportNotchCache(ctx, CacheStart)
+
+#   Report the hits and misses of the notch outline caches since CacheStart, in the debug file and the run stats
+def ReportNotchCache(ctx, CacheStart):
+    Hits, Misses = NotchCacheCounts()
+    Hits -= CacheStart[0]
+    Misses -= CacheStart[1]
+    ctx.DebugMsg("Notch outlines : %d hits, %d misses, hit rate %.1f%%\n", Hits, Misses, 100.0 * Hits / max(Hits + Misses, 1))
+    if ctx.Stats:
+        ctx.Stats.Count('notch_cache_hits', Hits)
+        ctx.Stats.Count('notch_cache_misses', Misses)
+
+#   Yield the paths of the walls then of the bottom, optimised if needed, one by one
+def IterPanels(ctx):
+    for path in IterWalls(ctx):
+        if ctx.OptimizeCuts and len(path.Opcodes):
+            path.Optimize()
+        yield path
+    if ctx.hasbottom:
+        path = DrawBottom(ctx)
+        if ctx.OptimizeCuts:
+            path.Optimize()
+        yield path
+
+#   Paths taken from the cache or cloned have no opcodes, they are already optimised if needed
+def OptimizePanels(Panels):
+    for path in Panels:
+        if len(path.Opcodes):
+            path.Optimize()
+
+#   Place the panels, in a single column or nested on sheets, and write their paths to sink
+#   In a single column, each panel is written once placed, so Panels could be an iterator
+def PlacePanels(ctx, Panels, sink):
+    Translate = ctx.PathCache is not None
+    if ctx.SheetWidth > 0 and ctx.SheetHeight > 0:
+        Panels = list(Panels)
+        nSheets = NestPanels(ctx, Panels)
+        #   One group per sheet
+        Sheets = [[] for n in range(nSheets)]
+        for path in Panels:
+            Sheets[path.Sheet].append(path)
+        for n, Sheet in enumerate(Sheets):
+            sink.OpenGroup({inkex.addNS('label', 'inkscape'): 'Sheet ' + str(n + 1)})
+            for path in Sheet:
+                path.GenPath(sink, Translate)
+            sink.CloseGroup()
+        return
+    #   Single column, under the drawing
+    x0, y0 = PanelOrigin(ctx)
+    ypos = -y0
+    xpos = -x0
+    for path in Panels:
+        ctx.DebugMsg("Place %s ypos =%s\n", path.name, ypos)
+        path.Place([xpos, ypos])
+        path.GenPath(sink, Translate)
+        ypos -= ctx.height + ctx.thickness + PANEL_SPACING
+
+#   Top left corner of the panels : under the drawing, unless set by the multi-box mode
+def PanelOrigin(ctx):
+    if ctx.PanelOrigin:
+        return ctx.PanelOrigin
+    return (ctx.BoundingBox[0], ctx.BoundingBox[3] + SHEET_SPACING)
+
+#   Right end of the panels of a box, once placed. In multi-box mode, the panels of the next box are placed after it
+def PanelsRight(ctx, Panels):
+    if ctx.SheetWidth > 0 and ctx.SheetHeight > 0:
+        Offsets = SheetOffsets(ctx.SheetWidth, [path.Sheet for path in Panels],
+                               [path.BoundingBox()[2] - path.BoundingBox()[0] for path in Panels])
+        return PanelOrigin(ctx)[0] + Offsets[-1] - SHEET_SPACING
+    return max(path.BoundingBox()[2] - path.PositionInPage[0] for path in Panels)
+
+#   x offset of each sheet from the first one, Sheets and Widths are the sheet and the width of each panel.
+#   A sheet is as wide as SheetWidth, or as its widest panel when a panel larger than the sheet is alone on it.
+#   Return nSheets + 1 offsets, the last one is where a next sheet would start
+def SheetOffsets(SheetWidth, Sheets, Widths):
+    SheetWidths = [SheetWidth] * (max(Sheets, default=-1) + 1)
+    for Sheet, w in zip(Sheets, Widths):
+        SheetWidths[Sheet] = max(SheetWidths[Sheet], w)
+    Offsets = [0.0]
+    for w in SheetWidths:
+        Offsets.append(Offsets[-1] + w + SHEET_SPACING)
+    return Offsets
+
+#   Nest the panels on sheets of SheetWidth x SheetHeight, with a "first fit decreasing height" shelf algorithm
+#   Panels are sorted by decreasing height, each one goes on the first shelf with enough room left,
+#   otherwise a new shelf is opened on the last sheet, or on a new sheet if the last one is full.
+#   As heights are decreasing, the first panel of a shelf gives its height.
+#   Sheets are placed side by side under the drawing (see SheetOffsets). Return the number of sheets
+def NestPanels(ctx, Panels):
+    SheetWidth = ctx.SheetWidth
+    SheetHeight = ctx.SheetHeight
+    Boxes = [path.BoundingBox() for path in Panels]
+    Order = sorted(range(len(Panels)), key=lambda i: (Boxes[i][1] - Boxes[i][3], Boxes[i][0] - Boxes[i][2]))
+    Shelves = []            #   [sheet, y, height, used width] for each shelf
+    SheetUsed = []          #   Used height of each sheet
+    Placement = [None] * len(Panels)
+    for i in Order:
+        xmin, ymin, xmax, ymax = Boxes[i]
+        w = xmax - xmin
+        h = ymax - ymin
+        if w > SheetWidth or h > SheetHeight:
+            inkex.errormsg('Panel ' + Panels[i].name + ' (' + str(round(w, 1)) + 'x' + str(round(h, 1)) + ') is larger than the sheet, placed on its own sheet')
+            SheetUsed.append(SheetHeight)
+            Placement[i] = (len(SheetUsed) - 1, 0, 0)
+            continue
+        for Shelf in Shelves:
+            if Shelf[3] + w <= SheetWidth and Shelf[2] >= h:
+                break
+        else:
+            #   No room on the open shelves, open a new one
+            if SheetUsed and SheetUsed[-1] + h <= SheetHeight:
+                Shelf = [len(SheetUsed) - 1, SheetUsed[-1], h, 0]
+            else:
+                SheetUsed.append(0)
+                Shelf = [len(SheetUsed) - 1, 0, h, 0]
+            SheetUsed[-1] += h + PANEL_SPACING
+            Shelves.append(Shelf)
+        Placement[i] = (Shelf[0], Shelf[3], Shelf[1])
+        Shelf[3] += w + PANEL_SPACING
+
+    #   Then move each panel to its place on the sheet
+    x0, y0 = PanelOrigin(ctx)
+    Offsets = SheetOffsets(SheetWidth, [Sheet for Sheet, x, y in Placement], [Box[2] - Box[0] for Box in Boxes])
+    for path, Box, (Sheet, x, y) in zip(Panels, Boxes, Placement):
+        x += x0 + Offsets[Sheet]
+        y += y0
+        ctx.DebugMsg("Place %s on sheet %d at (%s, %s)\n", path.name, Sheet + 1, x, y)
+        path.Sheet = Sheet
+        path.Place([Box[0] - x, Box[1] - y])
+    return len(SheetUsed)
+
+#   Union of rectangles (x0, y0, x1, y1) on a compressed grid : the columns and rows of the grid are the
+#   different x and y of the rectangles, and a cell is filled when at least one rectangle covers it.
+#   Return (xs, ys, Filled), Filled[i, j] is the cell from (xs[i], ys[j]) to (xs[i+1], ys[j+1]),
+#   or None when the grid would have more than MaxCells cells
+def RectangleUnion(Rectangles, MaxCells=None):
+    R = np.round(np.array(Rectangles, dtype=float).reshape(-1, 4), 6)
+    xs = np.unique(np.concatenate((R[:, 0], R[:, 2])))
+    ys = np.unique(np.concatenate((R[:, 1], R[:, 3])))
+    if MaxCells and len(xs) * len(ys) > MaxCells:
+        return None
+    return xs, ys, CoveredCells(xs, ys, R)
+
+#   Cells of the grid xs, ys covered by at least one of the rectangles, whose coordinates are values of xs and ys.
+#   Coverage is swept with a 2D difference array, +1 on the first and last corners of each rectangle
+#   and -1 on the two other ones, summed along x then along y.
+def CoveredCells(xs, ys, Rectangles):
+    R = np.round(np.array(Rectangles, dtype=float).reshape(-1, 4), 6)
+    ix = np.searchsorted(xs, (np.minimum(R[:, 0], R[:, 2]), np.maximum(R[:, 0], R[:, 2])))
+    iy = np.searchsorted(ys, (np.minimum(R[:, 1], R[:, 3]), np.maximum(R[:, 1], R[:, 3])))
+    Cover = np.zeros((len(xs), len(ys)), dtype=np.int32)
+    np.add.at(Cover, (ix[0], iy[0]), 1)
+    np.add.at(Cover, (ix[1], iy[0]), -1)
+    np.add.at(Cover, (ix[0], iy[1]), -1)
+    np.add.at(Cover, (ix[1], iy[1]), 1)
+    return Cover.cumsum(axis=0).cumsum(axis=1)[:-1, :-1] > 0
+
+#   Cells of the grid xs, ys inside the rectilinear polygons, whose coordinates are values of xs and ys (even-odd rule).
+#   Each vertical edge toggles the cells on its right, toggles are summed along x.
+def PolygonCells(xs, ys, Polygons):
+    Toggle = np.zeros((len(xs), len(ys) - 1), dtype=np.int32)
+    for Points in Polygons:
+        for k in range(len(Points)):
+            (xa, ya), (xb, yb) = Points[k - 1], Points[k]
+            if xa == xb and ya != yb:
+                i = np.searchsorted(xs, round(xa, 6))
+                ja, jb = np.searchsorted(ys, (round(min(ya, yb), 6), round(max(ya, yb), 6)))
+                Toggle[i, ja:jb] += 1
+    return Toggle.cumsum(axis=0)[:-1] % 2 == 1
+
+#   Directions of the contour edges, in grid steps, each one is the previous one turned by a quarter to the left
+CONTOUR_STEPS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+#   Contours of the filled cells of a compressed grid (see RectangleUnion)
+#   Each side of a filled cell next to an empty cell is an edge, oriented with the filled cell on its left.
+#   Edges are chained into closed loops. Where two cells touch at a corner only, the left turn is taken first,
+#   which keeps the outlines of two separate parts apart. A hole touching the outline of its part at a corner
+#   still makes a loop going twice through that corner : loops are split at each vertex they go through again,
+#   so that each contour is simple. Only the corners are kept, aligned points are dropped.
+#   Return a list of (points, area), area is positive for outer contours and negative for inner ones
+def TraceContours(xs, ys, Filled):
+    Padded = np.pad(Filled, 1)
+    Empty = ~Padded
+    ny = len(ys)
+    #   Vertex (i, j) of the grid is numbered i*ny + j, edges are (start vertex, direction), one mask per direction
+    Masks = (Filled & Empty[1:-1, :-2], Filled & Empty[2:, 1:-1], Filled & Empty[1:-1, 2:], Filled & Empty[:-2, 1:-1])
+    Corners = ((0, 0), (1, 0), (1, 1), (0, 1))
+    Outgoing = {}
+    for Direction, (Mask, (di, dj)) in enumerate(zip(Masks, Corners)):
+        ci, cj = np.nonzero(Mask)
+        for v in ((ci + di) * ny + cj + dj).tolist():
+            Outgoing.setdefault(v, []).append(Direction)
+    Moves = [dx * ny + dy for dx, dy in CONTOUR_STEPS]
+
+    Contours = []
+    while Outgoing:
+        Start, Directions = next(iter(Outgoing.items()))
+        First = Directions[0]
+        v = Start
+        Direction = First
+        Vertices = []
+        Turns = []
+        while True:
+            Directions = Outgoing[v]
+            Directions.remove(Direction)
+            if not Directions:
+                del Outgoing[v]
+            Vertices.append(v)
+            Turns.append(Direction)
+            v += Moves[Direction]
+            Available = Outgoing.get(v, [])
+            for Next in ((Direction + 1) % 4, Direction, (Direction + 3) % 4):
+                if v == Start and Next == First:
+                    break
+                if Next in Available:
+                    break
+            if v == Start and Next == First:
+                break
+            Direction = Next
+        #   Split the loop at the vertices it goes through again : the edges since the previous visit are a closed loop
+        Loops = []
+        Stack = []
+        Visited = {}
+        for v, Direction in zip(Vertices, Turns):
+            k = Visited.get(v)
+            if k is not None:
+                Loops.append(Stack[k:])
+                for u, d in Stack[k:]:
+                    del Visited[u]
+                del Stack[k:]
+            Visited[v] = len(Stack)
+            Stack.append((v, Direction))
+        Loops.append(Stack)
+        for Loop in Loops:
+            #   Keep the vertices where the direction changes
+            Points = [(float(xs[v // ny]), float(ys[v % ny])) for k, (v, Direction) in enumerate(Loop) if Direction != Loop[k - 1][1]]
+            Area = 0.0
+            for k in range(len(Points)):
+                Area += Points[k - 1][0] * Points[k][1] - Points[k][0] * Points[k - 1][1]
+            Contours.append((Points, Area / 2.0))
+    return Contours
+
+#   Group the bottom holes which overlap or touch, so that the laser never cuts the same line twice.
+#   Holes are swept by increasing x0 (as in FindCrossContacts) : the active holes are the ones which do not end
+#   before the current one starts, sorted by y0, and the current hole joins the cluster of each active hole
+#   it touches. Boxes are the holes as (x0, y0, x1, y1) with x0 <= x1 and y0 <= y1.
+#   Return the clusters, as lists of indexes in Boxes
+def ClusterHoles(Boxes):
+    MaxHeight = max([b[3] - b[1] for b in Boxes], default=0.0)
+    Cluster = list(range(len(Boxes)))
+    def Root(i):
+        while Cluster[i] != i:
+            Cluster[i] = Cluster[Cluster[i]]
+            i = Cluster[i]
+        return i
+    Active = []
+    ActiveEnds = []
+    for i in sorted(range(len(Boxes)), key=lambda i: Boxes[i][0]):
+        x0, y0, x1, y1 = Boxes[i]
+        while ActiveEnds and ActiveEnds[0][0] < x0 - EPSILON:
+            End, j = heapq.heappop(ActiveEnds)
+            del Active[bisect.bisect_left(Active, (Boxes[j][1], j))]
+        first = bisect.bisect_left(Active, (y0 - MaxHeight - EPSILON, -1))
+        last = bisect.bisect_right(Active, (y1 + EPSILON, len(Boxes)))
+        for yStart, j in Active[first:last]:
+            if Boxes[j][3] >= y0 - EPSILON:
+                Cluster[Root(j)] = Root(i)
+        bisect.insort(Active, (y0, i))
+        heapq.heappush(ActiveEnds, (x1, i))
+
+    Clusters = {}
+    for i in range(len(Boxes)):
+        Clusters.setdefault(Root(i), []).append(i)
+    return list(Clusters.values())
+
+#   Contours of the holes of one cluster (see ClusterHoles) : a hole touching no other hole is kept as it is,
+#   the holes of a larger cluster are merged by RectangleUnion
+def ClusterContours(Holes, Boxes, Members):
+    if len(Members) == 1:
+        h = Holes[Members[0]]
+        return [[(h[0], h[1]), (h[2], h[1]), (h[2], h[3]), (h[0], h[3])]]
+    xs, ys, Filled = RectangleUnion([Boxes[i] for i in Members])
+    return [Points for Points, Area in TraceContours(xs, ys, Filled)]
+
+#   Merge the bottom holes which overlap or touch (see ClusterHoles)
+#   Return the contours of the holes, as lists of (x, y) points
+def MergeHoles(Holes):
+    Boxes = [(min(h[0], h[2]), min(h[1], h[3]), max(h[0], h[2]), max(h[1], h[3])) for h in Holes]
+    Contours = []
+    for Members in ClusterHoles(Boxes):
+        Contours.extend(ClusterContours(Holes, Boxes, Members))
+    return Contours
+
+#   Contours of the bottom : the outline (list of rectilinear polygons) with the holes cut in it.
+#   Holes of the perimeter walls share their outer side with the outline, cut separately that side would be cut twice.
+#   So the clusters of holes with a side on the outline are removed from the outline on a compressed grid,
+#   and the outline is traced again (see TraceContours) : the slots on the edge become notches of the outline.
+#   The other clusters are merged as in MergeHoles.
+#   Return (outline contours, hole contours), as lists of (x, y) points
+def BottomContours(Outline, Holes, MaxCells=MAX_FOOTPRINT_CELLS):
+    Boxes = [(min(h[0], h[2]), min(h[1], h[3]), max(h[0], h[2]), max(h[1], h[3])) for h in Holes]
+    #   Sides of the outline, the horizontal ones by y and the vertical ones by x
+    HorizontalSides = {}
+    VerticalSides = {}
+    for Points in Outline:
+        for k in range(len(Points)):
+            (xa, ya), (xb, yb) = Points[k - 1], Points[k]
+            if ya == yb:
+                HorizontalSides.setdefault(round(ya, 6), []).append((min(xa, xb), max(xa, xb)))
+            else:
+                VerticalSides.setdefault(round(xa, 6), []).append((min(ya, yb), max(ya, yb)))
+    def OnOutline(Box):
+        x0, y0, x1, y1 = Box
+        for y in (y0, y1):
+            for Start, End in HorizontalSides.get(round(y, 6), ()):
+                if min(End, x1) - max(Start, x0) > EPSILON:
+                    return True
+        for x in (x0, x1):
+            for Start, End in VerticalSides.get(round(x, 6), ()):
+                if min(End, y1) - max(Start, y0) > EPSILON:
+                    return True
+        return False
+
+    OnEdge = []
+    Inner = []
+    for Members in ClusterHoles(Boxes):
+        if any(OnOutline(Boxes[i]) for i in Members):
+            OnEdge.append(Members)
+        else:
+            Inner.extend(ClusterContours(Holes, Boxes, Members))
+    if OnEdge:
+        EdgeBoxes = [Boxes[i] for Members in OnEdge for i in Members]
+        xs = np.unique(np.round([x for Points in Outline for x, y in Points] + [b[k] for b in EdgeBoxes for k in (0, 2)], 6))
+        ys = np.unique(np.round([y for Points in Outline for x, y in Points] + [b[k] for b in EdgeBoxes for k in (1, 3)], 6))
+        if len(xs) * len(ys) <= MaxCells:
+            Filled = PolygonCells(xs, ys, Outline) & ~CoveredCells(xs, ys, EdgeBoxes)
+            Traced = TraceContours(xs, ys, Filled)
+            return [Points for Points, Area in Traced if Area > 0], [Points for Points, Area in Traced if Area < 0] + Inner
+        inkex.errormsg("Too many holes on the bottom outline, they are cut apart from it")
+        for Members in OnEdge:
+            Inner.extend(ClusterContours(Holes, Boxes, Members))
+    return Outline, Inner
+
+#   Return True if the point (x, y) is inside the polygon Points (even-odd rule)
+def PointInPolygon(x, y, Points):
+    Inside = False
+    for k in range(len(Points)):
+        xa, ya = Points[k - 1]
+        xb, yb = Points[k]
+        if (ya > y) != (yb > y) and x < xa + (y - ya) * (xb - xa) / (yb - ya):
+            Inside = not Inside
+    return Inside
+
+#   Outline of the bottom following the walls : the outer contours of the union of the walls.
+#   Contours inside another one (walls standing alone inside a compartment) are dropped.
+#   Return the list of contours, or None when the walls are too many different coordinates (see MAX_FOOTPRINT_CELLS)
+def WallFootprint(ctx):
+    Walls = ctx.HorizontalWalls + ctx.VerticalWalls
+    Grid = RectangleUnion([(w.x0, w.y0, w.x1, w.y1) for w in Walls], MAX_FOOTPRINT_CELLS)
+    if Grid is None:
+        return None
+    Outer = [Points for Points, Area in TraceContours(*Grid) if Area > 0]
+    if len(Outer) > 1:
+        Inner = []
+        for k, Points in enumerate(Outer):
+            #   Point of the first cell of the contour, just inside the corner so that it is on no contour
+            (xa, ya), (xb, yb) = Points[0], Points[1]
+            ux = np.sign(xb - xa)
+            uy = np.sign(yb - ya)
+            x = xa + EPSILON / 10 * (ux - uy)
+            y = ya + EPSILON / 10 * (uy + ux)
+            if any(PointInPolygon(x, y, Other) for m, Other in enumerate(Outer) if m != k):
+                Inner.append(k)
+        Outer = [Points for k, Points in enumerate(Outer) if k not in Inner]
+    return Outer
+
+#   Draw the bottom, a rectangle (the bounding box) with the holes for the wall notches
+#   With the 'merged' and 'footprint' outlines (see BOTTOM_OUTLINES), touching holes are merged into one contour,
+#   holes on the edge become notches of the outline (see BottomContours),
+#   and with 'footprint' the outline follows the walls instead of the bounding box
+def DrawBottom(ctx):
+    BoundingBox = ctx.BoundingBox
+    path = PathBuilder("Bottom" + ctx.Name)
+    if ctx.BottomOutline != 'rectangle':
+        Outline = None
+        if ctx.BottomOutline == 'footprint':
+            Outline = WallFootprint(ctx)
+            if Outline is None:
+                inkex.errormsg("Too many walls to compute the bottom footprint, the bounding rectangle is used")
+        if Outline is None:
+            Outline = [[(BoundingBox[0], BoundingBox[1]), (BoundingBox[2], BoundingBox[1]),
+                        (BoundingBox[2], BoundingBox[3]), (BoundingBox[0], BoundingBox[3])]]
+        Outline, Holes = BottomContours(Outline, ctx.BottomHoles)
+        ctx.DebugMsg("Bottom : %d outline contour(s), %d holes merged into %d contours\n", len(Outline), len(ctx.BottomHoles), len(Holes))
+        if ctx.Stats:
+            ctx.Stats.Count('bottom_contours', len(Outline) + len(Holes))
+        for Points in Outline + Holes:
+            path.MoveTo(Points[0][0] - BoundingBox[0], Points[0][1] - BoundingBox[1])
+            for x, y in Points[1:] + Points[:1]:
+                path.LineTo(x - BoundingBox[0], y - BoundingBox[1])
+        path.Close()
+        return path
+    path.MoveTo(0, 0)
+    #First draw the exterior
+    path.LineToHRel(BoundingBox[2] - BoundingBox[0])
+    path.LineToVRel(BoundingBox[3] - BoundingBox[1])
+    path.LineToHRel(BoundingBox[0] - BoundingBox[2])
+    path.LineTo(0, 0)
+    #then the holes
+    for hole in ctx.BottomHoles:
+        path.MoveTo(hole[0]- BoundingBox[0], hole[1] - BoundingBox[1])
+        path.LineTo(hole[2]- BoundingBox[0], hole[1] - BoundingBox[1])
+        path.LineTo(hole[2]- BoundingBox[0], hole[3] - BoundingBox[1])
+        path.LineTo(hole[0]- BoundingBox[0], hole[3] - BoundingBox[1])
+        path.LineTo(hole[0]- BoundingBox[0], hole[1] - BoundingBox[1])
+    path.Close()
+    return path
 
 
 class drawerbox( inkex.Effect ):
@@ -430,16 +1896,100 @@ class drawerbox( inkex.Effect ):
           type = inkex.Boolean, dest = 'has_bottom', default = 'true',
           help = 'Gen bottom for drawer box')
 
+        self.arg_parser.add_argument('--bottom_outline', action = 'store',
+          type = str, dest = 'bottom_outline', default = 'rectangle', choices = BOTTOM_OUTLINES,
+          help = 'Bottom outline: bounding rectangle, with merged holes, or wall footprint with merged holes')
+
+        self.arg_parser.add_argument('--tolerance', action = 'store',
+          type = float, dest = 'tolerance', default = str(DEFAULT_TOLERANCE),
+          help = 'Alignment tolerance, closer coordinates are snapped together')
+
+        self.arg_parser.add_argument('--sheet_width', action = 'store',
+          type = float, dest = 'sheet_width', default = '0',
+          help = 'Width of the sheets the panels are nested on, 0 to draw them in a single column')
+
+        self.arg_parser.add_argument('--sheet_height', action = 'store',
+          type = float, dest = 'sheet_height', default = '0',
+          help = 'Height of the sheets the panels are nested on, 0 to draw them in a single column')
+
+        self.arg_parser.add_argument('--incremental', action = 'store',
+          type = inkex.Boolean, dest = 'incremental', default = 'false',
+          help = 'Replace the previous DrawerBox layer, reusing the walls which did not change')
+
+        self.arg_parser.add_argument('--deduplicate', action = 'store',
+          type = inkex.Boolean, dest = 'deduplicate', default = 'false',
+          help = 'Draw identical walls once, the other ones are clones')
+
+        self.arg_parser.add_argument('--optimize_cuts', action = 'store',
+          type = inkex.Boolean, dest = 'optimize_cuts', default = 'false',
+          help = 'Cut holes before outlines, in an order reducing the laser travel, and merge collinear segments')
+
+        self.arg_parser.add_argument('--multi_box', action = 'store',
+          type = inkex.Boolean, dest = 'multi_box', default = 'false',
+          help = 'Generate a box for each selected group (each top level group when nothing is selected)')
+
+        self.arg_parser.add_argument('--compact_walls', action = 'store',
+          type = inkex.Boolean, dest = 'compact_walls', default = 'false',
+          help = 'Store walls, contacts and crossings in arrays, to save memory on very large layouts')
+
+        self.arg_parser.add_argument('--stats', action = 'store',
+          type = inkex.Boolean, dest = 'stats', default = 'false',
+          help = 'Report the time of each phase, counters and peak memory as JSON')
+
+        self.arg_parser.add_argument('--stats_file', action = 'store',
+          type = str, dest = 'stats_file', default = '',
+          help = 'File of the JSON report, on stderr if empty')
+
         self.arg_parser.add_argument('--Mode_Debug', action = 'store',
           type = inkex.Boolean, dest = 'Mode_Debug', default = 'false',
           help = 'Output Debug information in file')
 
+        #   Grid tab : the walls are generated from these parameters instead of the drawing (see GridWalls)
+        self.arg_parser.add_argument('--tab', action = 'store',
+          type = str, dest = 'tab', default = 'box',
+          help = 'Active tab of the dialog')
+
+        self.arg_parser.add_argument('--grid_layout', action = 'store',
+          type = inkex.Boolean, dest = 'grid_layout', default = 'false',
+          help = 'Generate the walls of a grid instead of reading the rectangles of the drawing')
+
+        self.arg_parser.add_argument('--grid_width', action = 'store',
+          type = float, dest = 'grid_width', default = '200.0',
+          help = 'Outer width of the grid')
+
+        self.arg_parser.add_argument('--grid_height', action = 'store',
+          type = float, dest = 'grid_height', default = '150.0',
+          help = 'Outer height (depth) of the grid')
+
+        self.arg_parser.add_argument('--grid_rows', action = 'store',
+          type = int, dest = 'grid_rows', default = '2',
+          help = 'Number of rows of cells')
+
+        self.arg_parser.add_argument('--grid_columns', action = 'store',
+          type = int, dest = 'grid_columns', default = '3',
+          help = 'Number of columns of cells')
+
+        self.arg_parser.add_argument('--grid_column_widths', action = 'store',
+          type = str, dest = 'grid_column_widths', default = '',
+          help = 'Relative widths of the columns, as 1,2,1 (empty for equal widths)')
+
+        self.arg_parser.add_argument('--grid_row_heights', action = 'store',
+          type = str, dest = 'grid_row_heights', default = '',
+          help = 'Relative heights of the rows, as 1,2,1 (empty for equal heights)')
+
+        self.arg_parser.add_argument('--grid_merges', action = 'store',
+          type = str, dest = 'grid_merges', default = '',
+          help = 'Merged cells, as row,column,rows,columns separated by ; (numbered from 1)')
+
         # Debug Output file
         self.fDebug = None
 
         # Dictionary of warnings issued.  This to prevent from warning
         # multiple times about the same problem
         self.warnings = {}
+
+        # Node handlers of the SVG traversal, by tag
+        self.NodeHandlers = self.BuildNodeHandlers()
         
         #Get bounding rectangle
         self.xmin, self.xmax = ( 1.0E70, -1.0E70 )
@@ -461,7 +2011,7 @@ class drawerbox( inkex.Effect ):
     def DrawPoly(self, p, parent):
         group = etree.SubElement(parent, 'g')
         Newpath = inkcape_draw_cartesian((self.xmin - self.xmax - 10, 0), group)
-        DebugMsg('DrawPoly First element (0) : '+str(p[0])+ ' Call MoveTo('+ str(p[0][0])+','+str(p[0][1])+'\n')
+        self.ctx.DebugMsg('DrawPoly First element (0) : %s Call MoveTo(%s,%s)\n', p[0], p[0][0], p[0][1])
         Newpath.MoveTo(p[0][0], p[0][1])
         n = len( p )
         index = 1
@@ -470,227 +2020,114 @@ class drawerbox( inkex.Effect ):
             index += 1
         Newpath.GenPath()
 
-    #   Add a wall (rectangle)
-    #   x, y are the coordinates of the top left point, w and h are the width and length of the wall
-    #   If w > h the wall is horizontal, otherwise it is vertical.
-    #   Build a list of horizontal an vertical walls 
-    def AddWall(self, id, x, y, w, h):
-        Wall = wall(id, x, y, w, h)
-        if ( w > h ):
-            Wall.add(self.HorizontalWalls)
-        else:
-            Wall.add(self.VerticalWalls)
-
-
-
-    def AddRectangle(self, x, y, w, h, id, transform):
-        DebugMsg("Enter AddRectangle(id=" +id +") x=" + str(x) + ", y=" + str(y) + ", w=" + str(w) + ", h=" + str(h) + ', transform=' + str(transform) + '\n')
-        Angle = 0
-        if 'rotate' in transform:
-            #DebugMsg("Transform contains rotate\n")
-            pos_rotate =  transform.find('rotate(')
-            #DebugMsg("pos_rotate= " + str(pos_rotate) + '\n')
-            if ( pos_rotate >= 0 ):
-                Start_Rotate = pos_rotate + 7
-                EndRotate = transform.find(')', Start_Rotate)
-                #DebugMsg("StartRotate="+ str(Start_Rotate) +", EndRotate= " + str(EndRotate) + '\n')
-                if EndRotate > 0:
-                    strAngle = transform[Start_Rotate:EndRotate]
-                    Angle = float(strAngle)
-                    #DebugMsg("Transform Rotate, Angle =" + str(Angle) + '\n')
-                    Angle_rad = Angle * math.pi / 180
-
-                    xrot1 = round(x*math.cos(Angle_rad) - y*math.sin(Angle_rad), 1)
-                    yrot1 = round(x*math.sin(Angle_rad) + y*math.cos(Angle_rad), 1)
-                    xrot2 =round((x+w)*math.cos(Angle_rad) - (y+h)*math.sin(Angle_rad), 1)
-                    yrot2 = round((x+w)*math.sin(Angle_rad) + (y+h)*math.cos(Angle_rad), 1)
-                    #DebugMsg("After Rotate, xrot1 =" + str(xrot1) +", yrot1 =" + str(yrot1) + ", xrot2 =" + str(xrot2) +", yrot2 =" + str(yrot2) + '\n')
-                    xrect = min(xrot1, xrot2)
-                    yrect = min(yrot1, yrot2)
-                    wrect = abs(xrot1 - xrot2)
-                    hrect = abs(yrot1 - yrot2)
-                    DebugMsg("After Rotate, xrect =" + str(xrect) +", yrect =" + str(yrect) + ", wrect =" + str(wrect) +", hrect =" + str(hrect) + '\n')
-        elif 'scale' in transform:
-            DebugMsg("Transform contains scale\n")
-            pos_scale =  transform.find('scale(')
-            if ( pos_scale >= 0 ):
-                Start_Scale = pos_scale + 6
-                EndScaleX = transform.find(',', Start_Scale)
-                EndScaleY = transform.find(')', Start_Scale)
-                if EndScaleX > 0 and EndScaleY > 0:
-                    strScaleX = transform[Start_Scale:EndScaleX]
-                    strScaleY = transform[EndScaleX+1:EndScaleY]
-                    ScaleX = float(strScaleX)
-                    ScaleY = float(strScaleY)
-                    xscale1 = round(x*ScaleX, 1)
-                    yscale1 = round(y*ScaleY, 1)
-                    xscale2 =round((x+w)*ScaleX, 1)
-                    yscale2 = round((y+h)*ScaleY, 1)
-                    DebugMsg("After Scale, xscale1 =" + str(xscale1) +", yscale1 =" + str(yscale1) + ", xscale2 =" + str(xscale2) +", yscale2 =" + str(yscale2) + '\n')
-                    xrect = min(xscale1, xscale2)
-                    yrect = min(yscale1, yscale2)
-                    wrect = abs(xscale1 - xscale2)
-                    hrect = abs(yscale1 - yscale2)
-                    DebugMsg("After Rotate, xrect =" + str(xrect) +", yrect =" + str(yrect) + ", wrect =" + str(wrect) +", hrect =" + str(hrect) + '\n')
-        elif transform == 'None':
-            xrect = round(x, 1)
-            yrect = round(y, 1)
-            wrect = round(w, 1)
-            hrect = round(h, 1)
-        else:
-            inkex.errormsg( 'Unhandled transformation :' + transform )
-        self.AddWall(id, xrect, yrect, wrect, hrect)
-        if ( xrect < BoundingBox[0] ):
-            BoundingBox[0] = xrect
-        if ( yrect < BoundingBox[1] ):
-            BoundingBox[1] = yrect
-        if ( xrect+wrect > BoundingBox[2] ):
-            BoundingBox[2] = xrect + wrect
-        if ( yrect+hrect > BoundingBox[3] ):
-            BoundingBox[3] = yrect + hrect
-
-    def recursivelyTraverseSvg( self, aNodeList):
+    #   Add a rectangle, matrix is the transform from the rectangle coordinates to the document,
+    #   composed with the transforms of all its parents.
+    #   The rectangle is only queued, all rectangles are added at once after the traversal
+    def AddRectangle(self, x, y, w, h, id, matrix):
+        self.ctx.DebugMsg("Enter AddRectangle(id=%s) x=%s, y=%s, w=%s, h=%s, transform=%s\n", id, x, y, w, h, matrix)
+        self.ctx.QueueRectangle(id, x, y, w, h, matrix)
+
+    #   Build the table of node handlers, by tag (qualified or not), used by the SVG traversal
+    def BuildNodeHandlers(self):
+        Handlers = {}
+        def register(handler, tags, ns='svg'):
+            for tag in tags:
+                Handlers[inkex.addNS(tag, ns)] = handler
+                Handlers[tag] = handler
+        register(self.TraverseGroup, ['g'])
+        register(self.TraverseRect, ['rect'])
+        register(self.SkipWithMessage('Path detected, skip object\n'), ['path'])
+        register(self.SkipWithMessage('Line detected, skip\n'), ['line'])
+        register(self.SkipWithMessage('PolyLine detected, skip\n'), ['polyline'])
+        register(self.SkipWithMessage('Polygon detected, skip\n'), ['polygon'])
+        register(self.SkipWithMessage('Ellipse or circle detected, skip\n'), ['ellipse', 'circle'])
+        # Clones are the copies of panels added by a previous run (see PathBuilder.GenPath), they are no walls
+        register(self.SkipWithMessage('Clone detected, skip\n'), ['use'])
+        # Gradients and patterns are similar, style is a reference to an external style sheet and
+        # gamma curves, color temp, etc. (color-profile) are not relevant to single color output
+        register(self.SkipNode, ['pattern', 'metadata', 'defs', 'desc', 'eggbot', 'title', 'radialGradient',
+                                 'linearGradient', 'style', 'cursor', 'color-profile'])
+        register(self.SkipNode, ['namedview'], 'sodipodi')
+        register(self.WarnText, ['text'])
+        register(self.WarnImage, ['image'])
+        return Handlers
+
+    #   The transform of the group is composed once with the transform of its parent,
+    #   and the result is pushed with each child
+    def TraverseGroup(self, node, matrix, Stack):
+        transform = node.get('transform')
+        if transform:
+            matrix = matrix @ inkex.Transform(transform)
+        #   Children are pushed in reverse order, so that they are processed in document order
+        Stack.extend([(child, matrix) for child in reversed(node)])
+
+    def TraverseRect(self, node, matrix, Stack):
+        # Create a path with the outline of the rectangle
+        x = float( node.get( 'x', '0' ) )
+        y = float( node.get( 'y', '0' ) )
+        w = float( node.get( 'width', '0' ) )
+        h = float( node.get( 'height', '0' ) )
+        id = node.get("id", "no_id")
+
+        transform = node.get('transform')
+        if transform:
+            matrix = matrix @ inkex.Transform(transform)
+
+        self.AddRectangle(x, y, w, h, id, matrix)
+
+    def SkipWithMessage(self, message):
+        def handler(node, matrix, Stack):
+            self.ctx.DebugMsg(message)
+        return handler
+
+    def SkipNode(self, node, matrix, Stack):
+        pass
+
+    def WarnText(self, node, matrix, Stack):
+        inkex.errormsg( 'Warning: unable to draw text, please convert it to a path first.' )
+
+    def WarnImage(self, node, matrix, Stack):
+        if 'image' not in self.warnings:
+            inkex.errormsg( 'Warning: unable to draw bitmap images; ' +
+                'please convert them to line art first.  Consider using the "Trace bitmap..." ' +
+                'tool of the "Path" menu.  Mac users please note that some X11 settings may ' +
+                'cause cut-and-paste operations to paste in bitmap copies.' )
+            self.warnings['image'] = 1
+
+    def recursivelyTraverseSvg( self, aNodeList, matrix):
 
         '''
         [ This too is largely lifted from eggbot.py and path2openscad.py ]
 
-        Recursively walk the SVG document, building polygon vertex lists
-        for each graphical element we support.
+        Walk the SVG document, adding a wall for each rectangle.
+        The walk uses an explicit stack (no recursion, so deep nesting is not an issue)
+        and the handler of each node is found in the NodeHandlers table, by tag.
+        matrix is the transform of the parent of the nodes, transforms of groups are
+        composed along the walk so that rectangles are placed in document coordinates.
 
-        Rendered SVG elements:
-            <circle>, <ellipse>, <line>, <path>, <polygon>, <polyline>, <rect>
-            Except for path, all elements are first converted into a path the processed
+        Processed SVG elements:
+            <rect>
 
         Supported SVG elements:
             <group>
 
+        Skipped SVG elements:
+            <circle>, <ellipse>, <line>, <path>, <polygon>, <polyline>
+
         Ignored SVG elements:
             <defs>, <eggbot>, <metadata>, <namedview>, <pattern>,
             processing directives
 
-        All other SVG elements trigger an error (including <text>)
+        All other SVG elements trigger a warning (including <text>)
         '''
 
-        for node in aNodeList:
-
-            #DebugMsg("Node type :" + node.tag + '\n')
-            if node.tag == inkex.addNS( 'g', 'svg' ) or node.tag == 'g':
-                #DebugMsg("Group detected, recursive call\n")
-                self.recursivelyTraverseSvg( node )
-
-            elif node.tag == inkex.addNS( 'path', 'svg' ):
-                DebugMsg("Path detected, skip object\n")
-
-            elif node.tag == inkex.addNS( 'rect', 'svg' ) or node.tag == 'rect':
-
-                # Create a path with the outline of the rectangle
-                x = float( node.get( 'x' ) )
-                y = float( node.get( 'y' ) )
-                if ( not x ) or ( not y ):
-                    pass
-                w = float( node.get( 'width', '0' ) )
-                h = float( node.get( 'height', '0' ) )
-                id = node.get("id", "no_id")
-
-                transform = node.get('transform', "None")
-
-                #DebugMsg('Rectangle id='+id+', X='+ str(x)+',Y='+str(y)+', W='+str(w)+' H='+str(h)+', transform='+ transform+'\n' )
-                self.AddRectangle(x, y, w, h, id, transform)
-
-
-            elif node.tag == inkex.addNS( 'line', 'svg' ) or node.tag == 'line':
-
-                DebugMsg('Line detected, skip\n' )
-
-            elif node.tag == inkex.addNS( 'polyline', 'svg' ) or node.tag == 'polyline':
-
-                DebugMsg('PolyLine detected, skip\n' )
-
-            elif node.tag == inkex.addNS( 'polygon', 'svg' ) or node.tag == 'polygon':
-
-                DebugMsg('Polygon detected, skip\n' )
-
-            elif node.tag == inkex.addNS( 'ellipse', 'svg' ) or \
-                node.tag == 'ellipse' or \
-                node.tag == inkex.addNS( 'circle', 'svg' ) or \
-                node.tag == 'circle':
-
-                    DebugMsg('Ellipse or circle detected, skip\n' )
-
-            elif node.tag == inkex.addNS( 'pattern', 'svg' ) or node.tag == 'pattern':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'metadata', 'svg' ) or node.tag == 'metadata':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'defs', 'svg' ) or node.tag == 'defs':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'desc', 'svg' ) or node.tag == 'desc':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'namedview', 'sodipodi' ) or node.tag == 'namedview':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'eggbot', 'svg' ) or node.tag == 'eggbot':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'text', 'svg' ) or node.tag == 'text':
-
-                inkex.errormsg( 'Warning: unable to draw text, please convert it to a path first.' )
-
-                pass
-
-            elif node.tag == inkex.addNS( 'title', 'svg' ) or node.tag == 'title':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'image', 'svg' ) or node.tag == 'image':
-
-                if not self.warnings.has_key( 'image' ):
-                    inkex.errormsg( gettext.gettext( 'Warning: unable to draw bitmap images; ' +
-                        'please convert them to line art first.  Consider using the "Trace bitmap..." ' +
-                        'tool of the "Path" menu.  Mac users please note that some X11 settings may ' +
-                        'cause cut-and-paste operations to paste in bitmap copies.' ) )
-                    self.warnings['image'] = 1
-                pass
-
-            elif node.tag == inkex.addNS( 'pattern', 'svg' ) or node.tag == 'pattern':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'radialGradient', 'svg' ) or node.tag == 'radialGradient':
-
-                # Similar to pattern
-                pass
-
-            elif node.tag == inkex.addNS( 'linearGradient', 'svg' ) or node.tag == 'linearGradient':
-
-                # Similar in pattern
-                pass
-
-            elif node.tag == inkex.addNS( 'style', 'svg' ) or node.tag == 'style':
-
-                # This is a reference to an external style sheet and not the value
-                # of a style attribute to be inherited by child elements
-                pass
-
-            elif node.tag == inkex.addNS( 'cursor', 'svg' ) or node.tag == 'cursor':
-
-                pass
-
-            elif node.tag == inkex.addNS( 'color-profile', 'svg' ) or node.tag == 'color-profile':
-
-                # Gamma curves, color temp, etc. are not relevant to single color output
-                pass
-
-            elif not isinstance( node.tag, basestring ):
+        Stack = [(node, matrix) for node in reversed(list(aNodeList))]
+        while Stack:
+            node, matrix = Stack.pop()
+            handler = self.NodeHandlers.get(node.tag)
+            if handler:
+                handler(node, matrix, Stack)
+            elif not isinstance( node.tag, str ):
 
                 # This is likely an XML processing instruction such as an XML
                 # comment.  lxml uses a function reference for such node tags
@@ -703,114 +2140,265 @@ class drawerbox( inkex.Effect ):
             else:
 
                 inkex.errormsg( 'Warning: unable to draw object <%s>, please convert it to a path first.' % node.tag )
-                pass
 
 
-    def effect( self ):
-        global thickness, hasbottom, burn_factor, height, zNotches, zNotchesSize
-        # convert units
+    #   Return the last DrawerBox layer of the document, or None
+    def FindDrawerBoxLayer(self, svg):
+        Layers = self.FindDrawerBoxLayers(svg)
+        return Layers[-1] if Layers else None
+
+    #   All DrawerBox layers of the document, in document order
+    def FindDrawerBoxLayers(self, svg):
+        return [node for node in svg.iterchildren('g', inkex.addNS('g', 'svg'))
+                if node.get(inkex.addNS('label', 'inkscape')) == 'DrawerBox' and node.get(inkex.addNS('groupmode', 'inkscape')) == 'layer']
+
+    #   Prefix of the ids generated in the DrawerBox layer of rank Index (from 0) : the first layer uses the names
+    #   of the pieces, the next ones (runs without incremental mode) use 'drawerbox<n>_' + name, so that ids stay
+    #   unique in the document and the clones (see PathBuilder.GenPath) link to the pieces of their own layer
+    def LayerIdPrefix(self, svg, layer=None):
+        Layers = self.FindDrawerBoxLayers(svg)
+        Index = Layers.index(layer) if layer is not None else len(Layers)
+        return 'drawerbox%d_' % (Index + 1) if Index > 0 else ''
+
+    #   Create the generation context from the options, units are converted to user units
+    def CreateContext(self):
         unit = self.options.unit
         thickness = self.svg.unittouu(str(self.options.thickness) + unit)
         height = self.svg.unittouu(str(self.options.zc) + unit)
         burn_factor = self.svg.unittouu(str(self.options.burn_factor) + unit)
-        hasbottom = self.options.has_bottom
+        tolerance = self.svg.unittouu(str(self.options.tolerance) + unit)
+        ctx = BoxContext(thickness, height, burn_factor, self.options.has_bottom, tolerance)
+        ctx.SheetWidth = self.svg.unittouu(str(self.options.sheet_width) + unit)
+        ctx.SheetHeight = self.svg.unittouu(str(self.options.sheet_height) + unit)
+        ctx.Deduplicate = self.options.deduplicate
+        ctx.OptimizeCuts = self.options.optimize_cuts
+        ctx.CompactWalls = self.options.compact_walls
+        ctx.BottomOutline = self.options.bottom_outline
+        return ctx
+
+    #   Create the DrawerBox layer (or empty the previous one in incremental mode) and return the output group
+    def CreateOutputGroup(self, svg):
+        layer = None
+        if self.options.incremental:
+            #   The layer of the previous run is emptied and reused in place, its paths fill the cache
+            layer = self.FindDrawerBoxLayer(svg)
+            if layer is None:
+                self.ctx.PathCache = {}
+            else:
+                self.ctx.LoadPathCache(layer)
+                for child in list(layer):
+                    layer.remove(child)
+        self.IdPrefix = self.LayerIdPrefix(svg, layer)
+        if layer is None:
+            layer = etree.SubElement(svg, 'g')
+            layer.set(inkex.addNS('label', 'inkscape'), 'DrawerBox')
+            layer.set(inkex.addNS('groupmode', 'inkscape'), 'layer')
+        return etree.SubElement(layer, 'g')
+
+    #   Children of the document, without the DrawerBox layers (see FindDrawerBoxLayers) : the sheets,
+    #   boxes and bottoms generated by previous runs are not walls
+    def DocumentNodes(self, svg):
+        Layers = self.FindDrawerBoxLayers(svg)
+        return [node for node in svg if node not in Layers]
+
+    # Traverse the selected objects, or the whole document if nothing is selected (command line use)
+    # Transforms of the parents of the selected objects are taken into account
+    def TraverseDocument(self, svg):
+        if self.options.ids:
+            for id in self.options.ids:
+                node = self.svg.selected[id]
+                self.recursivelyTraverseSvg( [node], node.getparent().composed_transform() )
+        else:
+            self.recursivelyTraverseSvg( self.DocumentNodes(svg), svg.transform )
+
+    #   Add the walls of the box to the context : generated from the grid options (see GridWalls),
+    #   or read from the rectangles of the document
+    def AddBoxWalls(self, svg):
+        Stats = self.ctx.Stats
+        if self.options.grid_layout:
+            if Stats:
+                Stats.Phase('grid')
+            unit = self.options.unit
+            try:
+                AddGridWalls(self.ctx, self.svg.unittouu(str(self.options.grid_width) + unit),
+                             self.svg.unittouu(str(self.options.grid_height) + unit),
+                             self.options.grid_rows, self.options.grid_columns,
+                             ParseGridSizes(self.options.grid_column_widths), ParseGridSizes(self.options.grid_row_heights),
+                             ParseGridMerges(self.options.grid_merges))
+            except ValueError as e:
+                raise inkex.AbortExtension(str(e))
+        else:
+            if Stats:
+                Stats.Phase('traverse')
+            self.TraverseDocument(svg)
+            self.ctx.AddRectangles()
+
+    #   Find the boxes of the multi-box mode, return a list of (label, nodes)
+    #   Each selected group is a box, the other selected objects make one more box.
+    #   When nothing is selected, each group at the top level of the document or of a layer is a box.
+    def FindBoxes(self, svg):
+        Groups = (inkex.addNS('g', 'svg'), 'g')
+        if self.options.ids:
+            Nodes = [self.svg.selected[id] for id in self.options.ids]
+        else:
+            Nodes = []
+            for node in self.DocumentNodes(svg):
+                if node.tag in Groups and node.get(inkex.addNS('groupmode', 'inkscape')) == 'layer':
+                    Nodes.extend(node)
+                else:
+                    Nodes.append(node)
+        Boxes = []
+        Others = []
+        for node in Nodes:
+            if node.tag in Groups:
+                Boxes.append((node.get(inkex.addNS('label', 'inkscape')) or node.get('id', 'no_id'), [node]))
+            else:
+                Others.append(node)
+        if Others:
+            Boxes.append(('Others', Others))
+        return Boxes
+
+    #   Multi-box mode : each box has its own context, boxes are computed by a pool of threads,
+    #   then their panels are placed side by side under the drawing and written in one group per box
+    def GenerateBoxes(self, svg, sink):
+        Main = self.ctx
+        Stats = Main.Stats
+        Boxes = []
+        for Label, Nodes in self.FindBoxes(svg):
+            self.ctx = ctx = self.CreateContext()
+            ctx.Name = '_' + Label
+            ctx.PathCache = Main.PathCache
+            ctx.fDebug = Main.fDebug
+            ctx.DebugMsg("Box %s\n", Label)
+            for node in Nodes:
+                self.recursivelyTraverseSvg( [node], node.getparent().composed_transform() )
+            ctx.AddRectangles()
+            #   Groups without rectangles (for example the output of a previous run) are not boxes
+            if ctx.HorizontalWalls or ctx.VerticalWalls:
+                Boxes.append((Label, ctx))
+        self.ctx = Main
+        if not Boxes:
+            return
+
+        if Stats:
+            Stats.Phase('boxes')
+        CacheStart = NotchCacheCounts()
+        #   Boxes share the debug file, they are then computed one by one so that messages are not mixed
+        Workers = 1 if Main.fDebug else min(len(Boxes), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=Workers) as Executor:
+            BoxPanels = list(Executor.map(ComputeBox, [ctx for Label, ctx in Boxes]))
+
+        if Stats:
+            Stats.Phase('place')
+        x = min(ctx.BoundingBox[0] for Label, ctx in Boxes)
+        y = max(ctx.BoundingBox[3] for Label, ctx in Boxes) + SHEET_SPACING
+        for (Label, ctx), Panels in zip(Boxes, BoxPanels):
+            ctx.PanelOrigin = (x, y)
+            sink.OpenGroup({inkex.addNS('label', 'inkscape'): 'Box ' + Label})
+            PlacePanels(ctx, Panels, sink)
+            sink.CloseGroup()
+            x = PanelsRight(ctx, Panels) + SHEET_SPACING
+            if Stats:
+                Stats.CountBox(ctx, Panels)
+        if Stats:
+            Stats.Phase(None)
+            Stats.Count('boxes', len(Boxes))
+            Hits, Misses = NotchCacheCounts()
+            Stats.Count('notch_cache_hits', Hits - CacheStart[0])
+            Stats.Count('notch_cache_misses', Misses - CacheStart[1])
+
+    def StreamEffect(self, OutputFile):
+        '''
+        Same as effect, for command line use, but the document is written into OutputFile (a file name or a binary stream)
+        with an lxml.etree.xmlfile writer. The generated paths are written as soon as they are generated,
+        without being added to the document tree, so memory does not grow with the number of walls.
+        '''
+        self.ctx = self.CreateContext()
+        self.ctx.Streaming = True
+        if self.options.stats:
+            self.ctx.Stats = RunStats()
+            self.ctx.Stats.Phase('prepare')
+        svg = self.document.getroot()
+        #   In incremental mode, the previous layer fills the cache and the new layer is written in its place
+        PreviousLayer = None
+        if self.options.incremental:
+            PreviousLayer = self.FindDrawerBoxLayer(svg)
+            if PreviousLayer is None:
+                self.ctx.PathCache = {}
+            else:
+                self.ctx.LoadPathCache(PreviousLayer)
+        self.IdPrefix = self.LayerIdPrefix(svg, PreviousLayer)
+        if self.options.Mode_Debug:
+            self.ctx.OpenDebugFile()
+
+        self.AddBoxWalls(svg)
+
+        LayerAttribs = {inkex.addNS('label', 'inkscape'): 'DrawerBox', inkex.addNS('groupmode', 'inkscape'): 'layer'}
+        with etree.xmlfile(OutputFile, encoding='utf-8') as xf:
+            xf.write_declaration()
+            #   Comments and processing instructions before the root element
+            for node in reversed(list(svg.itersiblings(preceding=True))):
+                xf.write(node)
+            #   Declare the namespaces of the generated elements once, on the root element
+            #   SVG is the default namespace only, otherwise the writer would use the svg: prefix
+            nsmap = {prefix: uri for prefix, uri in svg.nsmap.items() if prefix is None or uri != inkex.NSS['svg']}
+            if None not in nsmap:
+                nsmap[None] = inkex.NSS['svg']
+            for prefix in ('inkscape', 'xlink'):
+                if inkex.NSS[prefix] not in nsmap.values():
+                    nsmap[prefix] = inkex.NSS[prefix]
+            with xf.element(svg.tag, dict(svg.attrib), nsmap=nsmap):
+                for node in svg:
+                    if node is PreviousLayer:
+                        self.StreamLayer(xf, node.tag, dict(node.attrib))
+                    else:
+                        xf.write(node)
+                if PreviousLayer is None:
+                    self.StreamLayer(xf, 'g', LayerAttribs)
+
+        self.ctx.CloseDebugFile()
+        if self.ctx.Stats:
+            self.ctx.Stats.Write(self.options.stats_file)
+
+    #   Write the DrawerBox layer, generating the box inside
+    def StreamLayer(self, xf, tag, attribs):
+        with xf.element(tag, attribs):
+            with xf.element('g'):
+                GenerateBox(self.ctx, StreamSink(xf, self.IdPrefix))
+
+    def effect( self ):
+        #   A new context for each run, the same process could generate several layouts (batch mode)
+        self.ctx = self.CreateContext()
+        if self.options.stats:
+            self.ctx.Stats = RunStats()
+            self.ctx.Stats.Phase('prepare')
 
         svg = self.document.getroot()
         docWidth = self.svg.unittouu(svg.get('width'))
         docHeigh = self.svg.unittouu(svg.attrib['height'])
-        self.HorizontalWalls = []
-        self.VerticalWalls = []
-        layer = etree.SubElement(svg, 'g')
-        layer.set(inkex.addNS('label', 'inkscape'), 'DrawerBox')
-        layer.set(inkex.addNS('groupmode', 'inkscape'), 'layer')
-        self.group = etree.SubElement(layer, 'g')
+        self.group = self.CreateOutputGroup(svg)
 
-        OpenDebugFile()
+        #   Debug file is only written when asked for, otherwise debug messages cost nothing
+        if self.options.Mode_Debug:
+            self.ctx.OpenDebugFile()
        
 
         # First traverse the document (or selected items), reducing
         # everything to line segments.  If working on a selection,
         # then determine the selection's bounding box in the process.
         # (Actually, we just need to know it's extrema on the x-axis.)
-
-        # Traverse the selected objects
-        for id in self.options.ids:
-            self.recursivelyTraverseSvg( [self.svg.selected[id]] ) 
-
-        #   Now for each H wall, look for end contact with a V wall
-        for w in self.HorizontalWalls:
-            w.LookForEndContact(self.VerticalWalls)
-
-        #   Now for each V wall, look for end contact with a H wall
-        for w in self.VerticalWalls:
-            w.LookForEndContact(self.HorizontalWalls)
-
-        DebugMsg("After End contact\n  Horizontal walls :" + str(len(self.HorizontalWalls)) + '\n')
-        for w in self.HorizontalWalls:
-            DebugMsg(str(w))
-        DebugMsg("Vertical walls :" + str(len(self.VerticalWalls)) + '\n')
-        for w in self.VerticalWalls:
-            DebugMsg(str(w))
-
-        DebugMsg("Fin contact\n")
-
-        
-        for w in self.HorizontalWalls:
-            w.LookForCrossContact(self.VerticalWalls)
-        DebugMsg("After Cross contact\n Horizontal walls :" + str(len(self.HorizontalWalls)) + '\n')
-        for w in self.HorizontalWalls:
-            DebugMsg(str(w))
-        DebugMsg("Vertical walls :" + str(len(self.VerticalWalls)) + '\n')
-        for w in self.VerticalWalls:
-            DebugMsg(str(w))
-        
-        # After this step, generate the walls
-
-        # Compute the number of notches from the height
-
-        if ( height < 30.0 ):
-            zNotches = 1
-        elif ( height < 70.0 ):
-            zNotches = 2
-        elif ( height < 110.0 ):
-            zNotches = 3
+        #   A grid is a single box, multi-box mode only applies to the drawing
+        if self.options.multi_box and not self.options.grid_layout:
+            if self.ctx.Stats:
+                self.ctx.Stats.Phase('traverse')
+            self.GenerateBoxes(svg, TreeSink(self.group, self.IdPrefix))
         else:
-            zNotches = 4
-        zNotchesSize = height / ( 2.0*zNotches + 1.0 )
-        ypos = -BoundingBox[3] - 10
-        xpos = -BoundingBox[0]
-
-        for w in self.HorizontalWalls:
-            DebugMsg("Draw H Wall " + w.id + " ypos =" + str(ypos) + '\n')
-            w.DrawWall(self.group, xpos, ypos)
-            ypos -= height + thickness + 3
-
-        for w in self.VerticalWalls:
-            DebugMsg("Draw V Wall " + w.id + " ypos =" + str(ypos) + '\n')
-            w.DrawWall(self.group, xpos, ypos)
-            ypos -= height + thickness + 3
-
-        #And last the bottom layer, if needed
-        if hasbottom:
-            PositionInPage = [xpos, ypos]
-            path = th_inkscape_path(PositionInPage, self.group, "Bottom")
-            path.MoveTo(0, 0)
-            #First draw the exterior
-            path.LineToHRel(BoundingBox[2] - BoundingBox[0])
-            path.LineToVRel(BoundingBox[3] - BoundingBox[1])
-            path.LineToHRel(BoundingBox[0] - BoundingBox[2])
-            path.LineTo(0, 0)
-            #then the holes
-            for hole in BottomHoles:
-                path.MoveTo(hole[0]- BoundingBox[0], hole[1] - BoundingBox[1])
-                path.LineTo(hole[2]- BoundingBox[0], hole[1] - BoundingBox[1])
-                path.LineTo(hole[2]- BoundingBox[0], hole[3] - BoundingBox[1])
-                path.LineTo(hole[0]- BoundingBox[0], hole[3] - BoundingBox[1])
-                path.LineTo(hole[0]- BoundingBox[0], hole[1] - BoundingBox[1])
-            path.Close()
-            path.GenPath()
-
-        CloseDebugFile()
+            self.AddBoxWalls(svg)
+            GenerateBox(self.ctx, TreeSink(self.group, self.IdPrefix))
+
+        self.ctx.CloseDebugFile()
+        if self.ctx.Stats:
+            self.ctx.Stats.Write(self.options.stats_file)
 
 if __name__ == '__main__':
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# coding: utf8
+
+
+# drawerbox_batch.py
+
+# Command line driver for the drawerbox extension, used to generate many layouts without Inkscape's UI.
+# Each input is either a SVG drawing, in this case all its rectangles are processed,
+# or a JSON file holding a plain list of rectangles, each one being
+#   {"id": "rect1", "x": 10, "y": 20, "width": 150, "height": 3}  or  [10, 20, 150, 3]
+# JSON coordinates are in mm.
+# Inputs could also be directories, then all .svg and .json files within are processed.
+# The extension options are passed as in Inkscape, with the --name=value form, for example
+#   python drawerbox_batch.py --thickness=3 --zc=40 --burn_factor=0.1 --has_bottom=true -o out layouts/*.json
+# Files are processed one by one, each output is written before the next input is read.
+# Inputs which would give the same output file (same base name) are reported before anything is generated.
+# With --jobs=N, layouts are spread across N worker processes. Outputs keep the input order,
+# and a failing layout is reported at the end instead of stopping the batch.
+# With --stream, the generated paths are written to the output file as soon as they are drawn,
+# instead of being added to the document first, which keeps memory low on very large layouts.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os.path
+import sys
+
+import inkex
+from lxml import etree
+from drawerbox import drawerbox
+
+INPUT_EXTENSIONS = ('.svg', '.json')
+OUTPUT_SUFFIX = '_drawerbox.svg'
+
+#   Extension instance of the current process, created once per worker process
+Worker = None
+#   True when the outputs are streamed (--stream)
+StreamOutput = False
+
+def RectanglesToSvg(Rectangles):
+    '''
+    Build a SVG document (unit mm) from a JSON list of rectangles, return it as bytes
+    '''
+    #   Namespaces of the generated elements are declared on the root, as in drawerbox.StreamEffect,
+    #   otherwise lxml adds ns0, ns1, ... prefixes where they are first used
+    nsmap = {prefix: inkex.NSS[prefix] for prefix in ('inkscape', 'sodipodi', 'xlink')}
+    nsmap[None] = inkex.NSS['svg']
+    svg = etree.Element(inkex.addNS('svg', 'svg'), nsmap=nsmap)
+    layer = etree.SubElement(svg, inkex.addNS('g', 'svg'))
+    xmax = 1.0
+    ymax = 1.0
+    for index, rect in enumerate(Rectangles):
+        if isinstance(rect, dict):
+            id = str(rect.get('id', 'rect' + str(index)))
+            x, y, w, h = (float(rect[key]) for key in ('x', 'y', 'width', 'height'))
+        else:
+            id = 'rect' + str(index)
+            x, y, w, h = (float(value) for value in rect[:4])
+        etree.SubElement(layer, inkex.addNS('rect', 'svg'), {'id': id, 'x': str(x), 'y': str(y), 'width': str(w), 'height': str(h)})
+        xmax = max(xmax, x + w)
+        ymax = max(ymax, y + h)
+    svg.set('width', str(xmax) + 'mm')
+    svg.set('height', str(ymax) + 'mm')
+    svg.set('viewBox', '0 0 ' + str(xmax) + ' ' + str(ymax))
+    return etree.tostring(svg)
+
+def IterInputs(Paths):
+    '''
+    Yield the input files one by one, directories are expanded to the .svg and .json files they contain
+    '''
+    for path in Paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(INPUT_EXTENSIONS) and not name.endswith(OUTPUT_SUFFIX):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def OutputName(OutputDir, InputPath):
+    base = os.path.splitext(os.path.basename(InputPath))[0]
+    return os.path.join(OutputDir, base + OUTPUT_SUFFIX)
+
+def GenerateLayout(effect, InputPath, OutputPath, Stream=False):
+    '''
+    Run the extension on one input file and write the resulting SVG
+    With Stream, the generated paths are written directly to the output file, see drawerbox.StreamEffect
+    The document is released afterwards, so memory does not grow with the number of files
+    '''
+    if InputPath.lower().endswith('.json'):
+        with open(InputPath) as f:
+            stream = RectanglesToSvg(json.load(f))
+    else:
+        stream = InputPath
+    effect.document = effect.load(stream)
+    #   Boxes of a multi box project are placed once all of them are computed, they are not streamed
+    if Stream and not effect.options.multi_box:
+        effect.StreamEffect(OutputPath)
+    else:
+        effect.effect()
+        with open(OutputPath, 'wb') as f:
+            effect.save(f)
+    effect.document = None
+    effect.original_document = None
+    effect.svg = None
+
+def InitWorker(ExtensionArgs, Stream=False):
+    global Worker, StreamOutput
+    Worker = drawerbox()
+    Worker.parse_arguments(ExtensionArgs)
+    StreamOutput = Stream
+
+def ProcessLayout(Paths):
+    '''
+    Generate one layout with the extension instance of this process
+    Return (input, output, error), error is None on success. Errors are returned so that the batch goes on.
+    '''
+    InputPath, OutputPath = Paths
+    try:
+        GenerateLayout(Worker, InputPath, OutputPath, StreamOutput)
+    except Exception as e:
+        return (InputPath, OutputPath, type(e).__name__ + ': ' + str(e))
+    return (InputPath, OutputPath, None)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate drawer box walls from SVG or JSON layouts, without Inkscape',
+        epilog='Other options (--unit, --thickness, --zc, --burn_factor, --has_bottom, ...) are passed to the extension, use the --name=value form.')
+    parser.add_argument('inputs', nargs='+', help='SVG or JSON layouts, or directories holding them')
+    parser.add_argument('-o', '--output-dir', dest='output_dir', default='.', help='Directory for the generated SVG files')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='Number of worker processes, 0 for one per CPU')
+    parser.add_argument('--stream', action='store_true', help='Write the generated paths directly to the output files')
+    args, ExtensionArgs = parser.parse_known_args(argv)
+
+    #   Also check the extension options before starting any worker
+    InitWorker(ExtensionArgs, args.stream)
+    Jobs = [(InputPath, OutputName(args.output_dir, InputPath)) for InputPath in IterInputs(args.inputs)]
+    #   Outputs are named from the input base name, two inputs (dir1/x.svg and dir2/x.svg, or x.svg and x.json)
+    #   would write the same file, at the same time with several workers
+    Inputs = {}
+    for InputPath, OutputPath in Jobs:
+        Inputs.setdefault(os.path.normcase(os.path.abspath(OutputPath)), []).append(InputPath)
+    Collisions = [InputPaths for InputPaths in Inputs.values() if len(InputPaths) > 1]
+    if Collisions:
+        parser.error('inputs with the same output file: ' + '; '.join(', '.join(InputPaths) for InputPaths in Collisions))
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    Errors = []
+    if args.jobs == 1:
+        Results = map(ProcessLayout, Jobs)
+        Executor = None
+    else:
+        Executor = ProcessPoolExecutor(max_workers=args.jobs or None, initializer=InitWorker, initargs=(ExtensionArgs, args.stream))
+        Results = Executor.map(ProcessLayout, Jobs, chunksize=4)
+    try:
+        for InputPath, OutputPath, Error in Results:
+            if Error:
+                Errors.append((InputPath, Error))
+            else:
+                print(OutputPath)
+    finally:
+        if Executor:
+            Executor.shutdown()
+    for InputPath, Error in Errors:
+        sys.stderr.write(InputPath + ': ' + Error + '\n')
+    return 1 if Errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# coding: utf8
+
+
+# drawerbox_bench.py
+
+# Benchmark of the drawerbox generation pipeline, on synthetic layouts, without Inkscape's UI.
+# Three kinds of layouts are generated, for each requested number of walls:
+#   grid        rows x columns of cells, H walls run across the box, V walls stop on them (T junctions)
+#   staircase   a triangle of cells, each row has one more cell than the previous one
+#   random      a box recursively split in two at random positions (guillotine cuts)
+# Each layout is run --repeat times, and for each phase the best time is kept:
+#   load (SVG parsing), traverse (SVG traversal, AddRectangle), add (AddRectangles),
+#   contacts (LookForEndContact), crosses (LookForCrossContact), draw (DrawWall),
+#   bottom, optimize (only with --optimize_cuts=true), place (layout and path generation) and serialise.
+# Results are written as a JSON report. With --compare, the times are compared with a previous report.
+# The extension options are passed as in Inkscape, with the --name=value form, for example
+#   python drawerbox_bench.py --sizes=10,100,1000 --layouts=grid,random -o bench.json --has_bottom=true
+# inkex (Inkscape 1.x extension module, with lxml) and numpy must be installed, for example with
+#   pip install inkex numpy
+# th_inkscape_path, simplepath and simplestyle are replaced by empty modules if missing,
+# they are only used by code which is not run.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import argparse
+import datetime
+import heapq
+import importlib
+import io
+import json
+import math
+import platform
+import random
+import sys
+import time
+import types
+
+#   Modules of the Inkscape 0.9x extensions imported by drawerbox, replaced by empty modules when missing
+StandIns = []
+for ModuleName in ('th_inkscape_path', 'simplepath', 'simplestyle'):
+    try:
+        importlib.import_module(ModuleName)
+    except ImportError:
+        sys.modules[ModuleName] = types.ModuleType(ModuleName)
+        StandIns.append(ModuleName)
+
+try:
+    import numpy as np
+    import inkex
+except ImportError as e:
+    sys.exit('drawerbox_bench.py needs inkex (with lxml) and numpy installed, for example with pip install inkex numpy: ' + str(e))
+import drawerbox
+from drawerbox_batch import RectanglesToSvg
+
+LAYOUTS = ('grid', 'staircase', 'random')
+DEFAULT_SIZES = '10,100,1000,10000'
+PHASES = ('load', 'traverse', 'add', 'contacts', 'crosses', 'draw', 'bottom', 'optimize', 'place', 'serialise')
+#   Size of the cells and thickness of the walls of the synthetic layouts, in mm
+CELL = 40.0
+THICKNESS = 3.0
+
+#   Grid of rows x columns cells : H walls run across the box, V walls are cut by each H wall
+def GridLayout(nWalls, Rng):
+    rows = max(1, int(math.sqrt(nWalls)) - 1)
+    columns = max(1, int(round((nWalls - rows - 1) / float(rows))) - 1)
+    Width = columns * CELL + THICKNESS
+    Rectangles = []
+    for i in range(rows + 1):
+        Rectangles.append([0, i * CELL, Width, THICKNESS])
+    for i in range(rows):
+        for j in range(columns + 1):
+            Rectangles.append([j * CELL, i * CELL + THICKNESS, THICKNESS, CELL - THICKNESS])
+    return Rectangles
+
+#   Triangle of cells, row i has i+1 cells. Each H wall covers the longest of the two rows it separates
+def StaircaseLayout(nWalls, Rng):
+    steps = max(1, int(math.sqrt(2 * nWalls)) - 1)
+    Rectangles = []
+    for i in range(steps + 1):
+        Rectangles.append([0, i * CELL, min(i + 1, steps) * CELL + THICKNESS, THICKNESS])
+    for i in range(steps):
+        for j in range(i + 2):
+            Rectangles.append([j * CELL, i * CELL + THICKNESS, THICKNESS, CELL - THICKNESS])
+    return Rectangles
+
+#   A box recursively split : the largest compartment is cut in two, across its longest side,
+#   by a wall which ends on the walls around the compartment
+def RandomLayout(nWalls, Rng):
+    Size = CELL * math.sqrt(max(nWalls, 4))
+    Rectangles = [[0, 0, Size, THICKNESS], [0, Size - THICKNESS, Size, THICKNESS],
+                  [0, THICKNESS, THICKNESS, Size - 2 * THICKNESS], [Size - THICKNESS, THICKNESS, THICKNESS, Size - 2 * THICKNESS]]
+    #   Compartments, as (-area, x0, y0, x1, y1) in a heap so that the largest one is split first
+    Compartments = [(-(Size - 2 * THICKNESS) ** 2, THICKNESS, THICKNESS, Size - THICKNESS, Size - THICKNESS)]
+    MinSize = 2 * THICKNESS
+    while len(Rectangles) < nWalls and Compartments:
+        Area, x0, y0, x1, y1 = heapq.heappop(Compartments)
+        Vertical = x1 - x0 > y1 - y0
+        Low, High = (x0, x1) if Vertical else (y0, y1)
+        if High - Low < 2 * MinSize + THICKNESS:
+            continue
+        Cut = round(Rng.uniform(Low + MinSize, High - MinSize - THICKNESS), 1)
+        if Vertical:
+            Rectangles.append([Cut, y0, THICKNESS, y1 - y0])
+            Parts = [(x0, y0, Cut, y1), (Cut + THICKNESS, y0, x1, y1)]
+        else:
+            Rectangles.append([x0, Cut, x1 - x0, THICKNESS])
+            Parts = [(x0, y0, x1, Cut), (x0, Cut + THICKNESS, x1, y1)]
+        for Part in Parts:
+            heapq.heappush(Compartments, (-(Part[2] - Part[0]) * (Part[3] - Part[1]),) + Part)
+    return Rectangles
+
+LayoutGenerators = {'grid': GridLayout, 'staircase': StaircaseLayout, 'random': RandomLayout}
+
+#   Run the pipeline of drawerbox.effect once on the SVG document Stream, phase by phase
+#   Return the time of each phase and some figures about the generated box
+def RunLayout(effect, Stream):
+    Times = {}
+    Clock = time.perf_counter
+
+    Start = Clock()
+    effect.document = effect.load(io.BytesIO(Stream))
+    Times['load'] = Clock() - Start
+
+    effect.ctx = ctx = effect.CreateContext()
+    svg = effect.document.getroot()
+    effect.group = effect.CreateOutputGroup(svg)
+    Start = Clock()
+    effect.TraverseDocument(svg)
+    Times['traverse'] = Clock() - Start
+
+    Start = Clock()
+    ctx.AddRectangles()
+    Times['add'] = Clock() - Start
+
+    Start = Clock()
+    drawerbox.FindEndContacts(ctx)
+    Times['contacts'] = Clock() - Start
+
+    Start = Clock()
+    drawerbox.FindCrossContacts(ctx)
+    #   As in GenerateBox, walls are compacted (--compact_walls=true) once crossings are found
+    if ctx.CompactWalls:
+        drawerbox.CompactWallLists(ctx)
+    Times['crosses'] = Clock() - Start
+
+    Start = Clock()
+    Panels = drawerbox.DrawWalls(ctx)
+    Times['draw'] = Clock() - Start
+
+    #   Phases which are not run (no bottom, no optimisation) have a null time
+    Times['bottom'] = Times['optimize'] = 0.0
+    if ctx.hasbottom:
+        Start = Clock()
+        Panels.append(drawerbox.DrawBottom(ctx))
+        Times['bottom'] = Clock() - Start
+
+    if ctx.OptimizeCuts:
+        Start = Clock()
+        drawerbox.OptimizePanels(Panels)
+        Times['optimize'] = Clock() - Start
+
+    Start = Clock()
+    drawerbox.PlacePanels(ctx, Panels, drawerbox.TreeSink(effect.group, effect.IdPrefix))
+    Times['place'] = Clock() - Start
+
+    Start = Clock()
+    Output = io.BytesIO()
+    effect.save(Output)
+    Times['serialise'] = Clock() - Start
+
+    Walls = ctx.HorizontalWalls + ctx.VerticalWalls
+    Figures = {
+        'walls': len(Walls),
+        'contacts': sum(len(w.ContactList) for w in Walls),
+        'crossings': sum(len(w.CrossList) for w in Walls) // 2,
+        'bottom_holes': len(ctx.BottomHoles),
+        'path_commands': sum(len(path.Opcodes) for path in Panels),
+        'output_bytes': len(Output.getvalue()),
+    }
+    effect.document = None
+    effect.svg = None
+    return Times, Figures
+
+def RunBenchmark(Layouts, Sizes, Repeat, Seed, ExtensionArgs):
+    effect = drawerbox.drawerbox()
+    effect.parse_arguments(ExtensionArgs)
+    Results = []
+    for Layout in Layouts:
+        for Size in Sizes:
+            Rectangles = LayoutGenerators[Layout](Size, random.Random(Seed))
+            Stream = RectanglesToSvg(Rectangles)
+            Best = None
+            for n in range(Repeat):
+                Times, Figures = RunLayout(effect, Stream)
+                Best = Times if Best is None else {Phase: min(Best[Phase], Times[Phase]) for Phase in PHASES}
+            Result = {'layout': Layout, 'size': Size, 'rectangles': len(Rectangles)}
+            Result.update(Figures)
+            Result['phases'] = {Phase: round(Best[Phase], 6) for Phase in PHASES}
+            Result['total'] = round(sum(Best.values()), 6)
+            Results.append(Result)
+            sys.stderr.write('%-10s %6d walls  %9.4f s\n' % (Layout, Figures['walls'], Result['total']))
+    return Results
+
+#   Print the time ratio (new / old) of each phase, for the layouts found in both reports
+def CompareReports(Old, New):
+    OldResults = {(r['layout'], r['size']): r for r in Old['results']}
+    print('%-10s %6s  %s  %s' % ('layout', 'size', ' '.join('%9s' % Phase[:9] for Phase in PHASES), '    total'))
+    for r in New['results']:
+        o = OldResults.get((r['layout'], r['size']))
+        if o is None:
+            continue
+        def Ratio(old, new):
+            return '%9.2f' % (new / old) if old > 0 and new > 0 else '%9s' % '-'
+        print('%-10s %6d  %s  %s' % (r['layout'], r['size'],
+            ' '.join(Ratio(o['phases'].get(Phase, 0), r['phases'][Phase]) for Phase in PHASES), Ratio(o['total'], r['total'])))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the drawerbox generation on synthetic layouts',
+        epilog='Other options (--thickness, --zc, --has_bottom, --optimize_cuts, ...) are passed to the extension, use the --name=value form. '
+               'inkex (with lxml) and numpy must be installed, th_inkscape_path, simplepath and simplestyle are optional.')
+    parser.add_argument('--layouts', default=','.join(LAYOUTS), help='Comma separated list of layouts among ' + ', '.join(LAYOUTS))
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma separated list of approximate numbers of walls')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each layout, the best time of each phase is kept')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random layouts')
+    parser.add_argument('-o', '--output', default='drawerbox_bench.json', help='JSON report')
+    parser.add_argument('--compare', help='Previous JSON report to compare with')
+    args, ExtensionArgs = parser.parse_known_args(argv)
+
+    Layouts = args.layouts.split(',')
+    for Layout in Layouts:
+        if Layout not in LayoutGenerators:
+            parser.error('unknown layout ' + Layout)
+    Sizes = [int(Size) for Size in args.sizes.split(',')]
+    Report = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'inkex': getattr(inkex, '__version__', None),
+        'stand_ins': StandIns,
+        'extension_args': ExtensionArgs,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': RunBenchmark(Layouts, Sizes, args.repeat, args.seed, ExtensionArgs),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(Report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            CompareReports(json.load(f), Report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# coding: utf8
+
+# test_drawerbox.py
+
+# Regression tests of drawerbox : contact search, snapping, grid layouts, nesting, cut order and bottom contours
+#   python -m unittest test_drawerbox
+# inkex is needed, th_inkscape_path, simplepath and simplestyle are replaced by empty modules if missing,
+# as in drawerbox_bench.py.
+
+import importlib
+import random
+import sys
+import types
+import unittest
+
+for ModuleName in ('th_inkscape_path', 'simplepath', 'simplestyle'):
+    try:
+        importlib.import_module(ModuleName)
+    except ImportError:
+        sys.modules[ModuleName] = types.ModuleType(ModuleName)
+
+import drawerbox
+
+
+#   Context with Count random walls of thickness 3 on a grid of 3, so that many ends touch and many walls cross
+def RandomWalls(Seed, Count=300):
+    Rng = random.Random(Seed)
+    ctx = drawerbox.BoxContext(3.0, 40.0, 0.1, False)
+    Starts = set()
+    while len(Starts) < Count:
+        x = Rng.randrange(40) * 3
+        y = Rng.randrange(40) * 3
+        if (x, y) in Starts:
+            continue
+        Starts.add((x, y))
+        Length = Rng.randrange(2, 16) * 3
+        if Rng.random() < 0.5:
+            ctx.AddWall('w%d' % len(Starts), x, y, Length, 3)
+        else:
+            ctx.AddWall('w%d' % len(Starts), x, y, 3, Length)
+    return ctx
+
+
+#   End contacts as found before WallIndex : each wall is checked against all the walls of the other list
+def BruteForceEndContacts(ctx):
+    drawerbox.SnapWalls(ctx)
+    drawerbox.SortWalls(ctx.HorizontalWalls, False)
+    drawerbox.SortWalls(ctx.VerticalWalls, True)
+    for h in ctx.HorizontalWalls:
+        for v in ctx.VerticalWalls:
+            if h.x0 == v.x1:
+                h.SetEndContact(v, h.y0, h.y1, v.y0, v.y1, drawerbox.CONTACT_LEFT)
+            if h.x1 == v.x0:
+                h.SetEndContact(v, h.y0, h.y1, v.y0, v.y1, drawerbox.CONTACT_RIGHT)
+    for v in ctx.VerticalWalls:
+        for h in ctx.HorizontalWalls:
+            if v.y0 == h.y1:
+                v.SetEndContact(h, v.x0, v.x1, h.x0, h.x1, drawerbox.CONTACT_TOP)
+            if v.y1 == h.y0:
+                v.SetEndContact(h, v.x0, v.x1, h.x0, h.x1, drawerbox.CONTACT_BOTTOM)
+
+
+#   Crossings as found before the sweep line : each H wall is checked against all V walls
+def BruteForceCrossContacts(ctx):
+    for h in ctx.HorizontalWalls:
+        for v in ctx.VerticalWalls:
+            if h.x0 < v.x0 and h.x1 > v.x1 and h.y0 > v.y0 and h.y1 < v.y1:
+                h.AddCrossing(v)
+
+
+def WallContacts(ctx):
+    return [(w.id, w.Contact, sorted((c.direction, c.start, c.end) for c in w.ContactList))
+            for w in ctx.HorizontalWalls + ctx.VerticalWalls]
+
+
+class ContactTest(unittest.TestCase):
+
+    def test_indexed_end_contacts(self):
+        Indexed = RandomWalls(1)
+        drawerbox.FindEndContacts(Indexed)
+        Expected = RandomWalls(1)
+        BruteForceEndContacts(Expected)
+        self.assertEqual(WallContacts(Indexed), WallContacts(Expected))
+        self.assertGreater(sum(len(Contacts) for Id, Flags, Contacts in WallContacts(Expected)), 50)
+
+    def test_sweep_line_crossings(self):
+        Swept = RandomWalls(2)
+        drawerbox.FindEndContacts(Swept)
+        drawerbox.LookForCrossContacts(Swept.HorizontalWalls, Swept.VerticalWalls)
+        Expected = RandomWalls(2)
+        drawerbox.FindEndContacts(Expected)
+        BruteForceCrossContacts(Expected)
+        self.assertEqual([w.CrossList for w in Swept.HorizontalWalls + Swept.VerticalWalls],
+                         [w.CrossList for w in Expected.HorizontalWalls + Expected.VerticalWalls])
+        self.assertGreater(sum(len(w.CrossList) for w in Expected.HorizontalWalls), 50)
+
+
+class SnapCoordinatesTest(unittest.TestCase):
+
+    def test_values_within_tolerance(self):
+        #   Unit conversions give values a little off, they snap to the same key
+        Values, Keys = drawerbox.SnapCoordinates([10.0, 9.98, 10.03, 20.0, 25.04, 24.99], 0.05)
+        self.assertEqual(Keys.tolist(), [100, 100, 100, 200, 250, 250])
+        self.assertEqual(Values.tolist(), [10.0, 10.0, 10.0, 20.0, 25.0, 25.0])
+
+    def test_values_apart(self):
+        Values, Keys = drawerbox.SnapCoordinates([10.0, 10.1, 10.2], 0.05)
+        self.assertEqual(Keys.tolist(), [100, 101, 102])
+
+    def test_no_chaining(self):
+        #   Each gap is within tolerance, but not the whole span : groups start again after 10.05
+        Values, Keys = drawerbox.SnapCoordinates([10.08, 10.0, 10.04, 10.12], 0.05)
+        self.assertEqual(Keys.tolist(), [101, 100, 100, 101])
+
+
+class GridWallsTest(unittest.TestCase):
+
+    def test_overlapping_merges(self):
+        drawerbox.GridWalls(100, 100, 3, 3, 3, Merges=[(0, 0, 2, 2), (2, 0, 1, 3)])
+        with self.assertRaises(ValueError):
+            drawerbox.GridWalls(100, 100, 3, 3, 3, Merges=[(0, 0, 2, 2), (1, 1, 2, 2)])
+
+
+class NestPanelsTest(unittest.TestCase):
+
+    def test_panels_on_sheets(self):
+        Rng = random.Random(3)
+        ctx = drawerbox.BoxContext(3.0, 40.0, 0.1, False)
+        ctx.BoundingBox = [0.0, 0.0, 100.0, 100.0]
+        ctx.SheetWidth = 300.0
+        ctx.SheetHeight = 200.0
+        Panels = []
+        for k in range(80):
+            path = drawerbox.PathBuilder('panel%d' % k)
+            path.MoveTo(0, 0)
+            path.LineTo(Rng.uniform(5, 150), Rng.uniform(5, 80))
+            Panels.append(path)
+        nSheets = drawerbox.NestPanels(ctx, Panels)
+        self.assertGreater(nSheets, 1)
+        x0, y0 = drawerbox.PanelOrigin(ctx)
+        Offsets = drawerbox.SheetOffsets(ctx.SheetWidth, [path.Sheet for path in Panels], [ctx.SheetWidth] * len(Panels))
+        Placed = []
+        for path in Panels:
+            xmin, ymin, xmax, ymax = path.BoundingBox()
+            Box = (xmin - path.PositionInPage[0], ymin - path.PositionInPage[1], xmax - path.PositionInPage[0], ymax - path.PositionInPage[1])
+            Left = x0 + Offsets[path.Sheet]
+            self.assertTrue(Left - drawerbox.EPSILON <= Box[0] and Box[2] <= Left + ctx.SheetWidth + drawerbox.EPSILON, path.name)
+            self.assertTrue(y0 - drawerbox.EPSILON <= Box[1] and Box[3] <= y0 + ctx.SheetHeight + drawerbox.EPSILON, path.name)
+            for Other in Placed:
+                self.assertFalse(Box[0] < Other[2] and Other[0] < Box[2] and Box[1] < Other[3] and Other[1] < Box[3], path.name)
+            Placed.append(Box)
+
+
+#   Unit segments of the subpaths of path, coordinates are integers. Merged collinear segments give the same pieces
+def UnitSegments(path):
+    Pieces = set()
+    for Points in path.Subpaths():
+        for (xa, ya), (xb, yb) in zip(Points, Points[1:]):
+            xa, ya, xb, yb = (int(round(v)) for v in (xa, ya, xb, yb))
+            if ya == yb:
+                Pieces.update(((x, ya), (x + 1, ya)) for x in range(min(xa, xb), max(xa, xb)))
+            else:
+                Pieces.update(((xa, y), (xa, y + 1)) for y in range(min(ya, yb), max(ya, yb)))
+    return Pieces
+
+
+class OptimizeTest(unittest.TestCase):
+
+    def test_same_segments(self):
+        Rng = random.Random(4)
+        path = drawerbox.PathBuilder('Bottom')
+        path.MoveTo(0, 0)
+        path.LineToHRel(500)
+        path.LineToVRel(300)
+        path.LineToHRel(-500)
+        path.LineTo(0, 0)
+        for k in range(200):
+            x = Rng.randrange(1, 490)
+            y = Rng.randrange(1, 290)
+            w = 2 * Rng.randrange(1, 5)
+            h = Rng.randrange(1, 8)
+            path.MoveTo(x, y)
+            #   A point in the middle of the first side, and a null segment, as notch holes could have
+            path.LineTo(x + w // 2, y)
+            path.LineTo(x + w, y)
+            path.LineTo(x + w, y)
+            path.LineTo(x + w, y + h)
+            path.LineTo(x, y + h)
+            path.LineTo(x, y)
+        path.Close()
+        Expected = UnitSegments(path)
+        path.Optimize()
+        self.assertEqual(UnitSegments(path), Expected)
+        Subpaths = path.Subpaths()
+        self.assertEqual(len(Subpaths), 201)
+        #   Outline last
+        self.assertEqual(sorted(Subpaths[-1]), [(0, 0), (0, 0), (0, 300), (500, 0), (500, 300)])
+
+
+def Contours(Rectangles):
+    return drawerbox.TraceContours(*drawerbox.RectangleUnion(Rectangles))
+
+
+class TraceContoursTest(unittest.TestCase):
+
+    def assertSimple(self, Traced):
+        for Points, Area in Traced:
+            self.assertEqual(len(set(Points)), len(Points), Points)
+
+    def test_corner_touching_rectangles(self):
+        #   Two rectangles touching at (10, 10) only : two separate outer contours
+        Traced = Contours([(0, 0, 10, 10), (10, 10, 20, 20)])
+        self.assertSimple(Traced)
+        self.assertEqual(sorted(Area for Points, Area in Traced), [100.0, 100.0])
+        self.assertEqual(sorted(len(Points) for Points, Area in Traced), [4, 4])
+
+    def test_hole_touching_outline_at_corner(self):
+        #   3 x 3 cells of 10, without the center cell (the hole) and the top right cell,
+        #   the corner (20, 10) of the hole touches the outside : one outline and one hole
+        Traced = Contours([(0, 0, 20, 10), (0, 10, 10, 30), (10, 20, 30, 30), (20, 10, 30, 20)])
+        self.assertSimple(Traced)
+        self.assertEqual(sorted(Area for Points, Area in Traced), [-100.0, 800.0])
+
+    def test_merged_holes(self):
+        #   Holes of two walls back to back become one contour, a hole touching nothing is kept as it is
+        Holes = drawerbox.MergeHoles([(100, 30, 103, 20), (103, 30, 106, 20), (100, 60, 103, 50)])
+        self.assertEqual(Holes, [[(100.0, 20.0), (106.0, 20.0), (106.0, 30.0), (100.0, 30.0)],
+                                 [(100, 60), (103, 60), (103, 50), (100, 50)]])
+
+    def test_edge_holes_are_notches(self):
+        #   Holes of perimeter walls share their outer side with the outline : no side is cut twice
+        Outline = [[(0, 0), (100, 0), (100, 60), (0, 60)]]
+        Holes = [(20, 0, 23, 10), (23, 0, 26, 10), (97, 30, 100, 40), (50, 57, 53, 60), (50, 30, 53, 40)]
+        Outline, Holes = drawerbox.BottomContours(Outline, Holes)
+        self.assertEqual(len(Outline), 1)
+        self.assertEqual(len(Holes), 1)
+        OutlineSides = Sides(Outline)
+        for Side in Sides(Holes):
+            self.assertFalse(any(Overlap(Side, Other) for Other in OutlineSides), Side)
+        #   Three notches, 4 more corners each
+        self.assertEqual(len(Outline[0]), 16)
+
+
+def Sides(Contours):
+    return [(Points[k - 1], Points[k]) for Points in Contours for k in range(len(Points))]
+
+
+#   True if the two axis aligned sides are on the same line and share a part of positive length
+def Overlap(Side, Other):
+    (xa, ya), (xb, yb) = Side
+    (xc, yc), (xd, yd) = Other
+    if ya == yb == yc == yd:
+        return min(max(xa, xb), max(xc, xd)) > max(min(xa, xb), min(xc, xd))
+    if xa == xb == xc == xd:
+        return min(max(ya, yb), max(yc, yd)) > max(min(ya, yb), min(yc, yd))
+    return False
+
+
+if __name__ == '__main__':
+    unittest.main()